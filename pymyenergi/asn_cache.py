@@ -0,0 +1,71 @@
+#  SPDX-License-Identifier: Apache-2.0
+"""
+On-disk cache of myenergi active server (ASN) hosts per hub serial.
+
+"""
+import json
+import logging
+import os
+import tempfile
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class AsnCache:
+    """Persist the X_MYENERGI-asn host for each hub serial in a JSON file."""
+
+    def __init__(self, path) -> None:
+        self.path = os.path.expanduser(path)
+        self._entries = None
+
+    def _read(self):
+        try:
+            with open(self.path) as cache_file:
+                entries = json.load(cache_file)
+            return entries if isinstance(entries, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            _LOGGER.debug(f"Ignoring unreadable ASN cache {self.path}")
+            return {}
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = self._read()
+        return self._entries
+
+    def _update(self, serial, asn):
+        # Apply the change to the file as it is now, other instances and
+        # processes may have written their own hubs since it was loaded
+        entries = self._read()
+        if asn is None:
+            entries.pop(serial, None)
+        else:
+            entries[serial] = asn
+        self._entries = entries
+        self._save()
+
+    def _save(self):
+        directory = os.path.dirname(self.path) or "."
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".asn-")
+            with os.fdopen(fd, "w") as cache_file:
+                json.dump(self._entries, cache_file)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            _LOGGER.debug(f"Could not write ASN cache {self.path}")
+
+    def get(self, serial):
+        """Cached ASN host for a hub serial, or None"""
+        return self._load().get(str(serial))
+
+    def set(self, serial, asn):
+        """Store the ASN host for a hub serial"""
+        if self._load().get(str(serial)) != asn:
+            self._update(str(serial), asn)
+
+    def invalidate(self, serial):
+        """Forget the ASN host for a hub serial"""
+        if self._load().get(str(serial)) is not None:
+            self._update(str(serial), None)
@@ -0,0 +1,58 @@
+#  SPDX-License-Identifier: Apache-2.0
+"""
+Digest authentication for the myenergi API.
+
+"""
+import httpx
+
+
+class PreemptiveDigestAuth(httpx.DigestAuth):
+    """Digest auth that remembers the server challenge for each host.
+
+    After the first 401 challenge from a host, later requests to the same
+    host are sent with the Authorization header computed up front using the
+    cached nonce and an incrementing nonce count. A new challenge is only
+    answered when the server rejects the cached nonce, for example because it
+    has gone stale.
+    """
+
+    def __init__(self, username, password) -> None:
+        super().__init__(username, password)
+        self._challenges = {}
+
+    def _authorize(self, request, host):
+        challenge, nonce_count = self._challenges[host]
+        self._nonce_count = nonce_count
+        request.headers["Authorization"] = self._build_auth_header(request, challenge)
+        self._challenges[host] = (challenge, self._nonce_count)
+
+    def forget(self, host=None):
+        """Drop the cached challenge for a host, or for all hosts"""
+        if host is None:
+            self._challenges.clear()
+        else:
+            self._challenges.pop(host, None)
+
+    def auth_flow(self, request):
+        host = request.url.host
+        if host in self._challenges:
+            self._authorize(request, host)
+
+        response = yield request
+
+        if response.status_code != 401:
+            return
+        for auth_header in response.headers.get_list("www-authenticate"):
+            if auth_header.lower().startswith("digest "):
+                break
+        else:
+            return
+
+        self._challenges[host] = (
+            self._parse_challenge(request, response, auth_header),
+            1,
+        )
+        self._authorize(request, host)
+        if response.cookies:
+            httpx.Cookies(response.cookies).set_cookie_header(request=request)
+        yield request
@@ -4,14 +4,27 @@ from abc import abstractmethod
 from datetime import datetime
 from datetime import timedelta
 from datetime import timezone
+from functools import lru_cache
 
 from pymyenergi.connection import Connection
 
 from . import HOUR
 from . import MINUTE
+from .history import HistorySeries
+from .history import sum_energy
 
 _LOGGER = logging.getLogger(__name__)
 
+# Data keys of the CT name, power and phase for each CT slot
+CT_NAME_KEYS = {slot: f"ectt{slot}" for slot in range(1, 7)}
+CT_POWER_KEYS = {slot: f"ectp{slot}" for slot in range(1, 7)}
+CT_PHASE_KEYS = {slot: f"ect{slot}p" for slot in range(1, 7)}
+
+
+@lru_cache(maxsize=None)
+def _ct_key(name):
+    return CT(name).name_as_key
+
 
 class CT:
     """Current Transformer class"""
@@ -58,6 +71,11 @@ class CT:
 class BaseDevice(ABC):
     """Base class for myenergi devices"""
 
+    # CT slots the device has, ct1 to ctN
+    ct_slots = (1, 2)
+    # CT slots counted in the client's power totals
+    totals_ct_slots = ct_slots
+
     def __init__(self, connection: Connection, serialno, data=None) -> None:
         self._connection = connection
         self._serialno = serialno
@@ -80,9 +98,9 @@ class BaseDevice(ABC):
     def _create_ct(self, ct_number):
         """Create a CT from data"""
         return CT(
-            self._data.get(f"ectt{ct_number}", "None"),
-            self._data.get(f"ectp{ct_number}", 0),
-            self._data.get(f"ect{ct_number}p", None),
+            self._data.get(CT_NAME_KEYS[ct_number], "None"),
+            self._data.get(CT_POWER_KEYS[ct_number], 0),
+            self._data.get(CT_PHASE_KEYS[ct_number], None),
         )
 
     async def fetch_data(self):
@@ -111,32 +129,22 @@ class BaseDevice(ABC):
             date_from = datetime.now(timezone.utc) - timedelta(hours=how_long)
         return await self.fetch_history_data(date_from, how_long, HOUR, raw_response)
 
+    async def history_series(self, date_from, how_long=1440, resolution=MINUTE):
+        """History as columns per minute or hour, see HistorySeries"""
+        rows = await self.fetch_history_data(date_from, how_long, resolution, True)
+        start = datetime(
+            date_from.year,
+            date_from.month,
+            date_from.day,
+            date_from.hour,
+            tzinfo=timezone.utc,
+        ).timestamp()
+        step = 60 if resolution == MINUTE else 3600
+        return HistorySeries.from_rows(rows, int(start), how_long, resolution, step)
+
     async def fetch_history_data(
         self, date_from, how_long, resolution, raw_response=False
     ):
-        energy_wh = {
-            "gep": 0,
-            "gen": 0,
-            "imp": 0,
-            "exp": 0,
-            "h1d": 0,
-            "h1b": 0,
-            "h2d": 0,
-            "h2b": 0,
-            "h3d": 0,
-            "h3b": 0,
-            "ct1": 0,
-            "ct2": 0,
-            "ct3": 0,
-            "ct4": 0,
-            "ct5": 0,
-            "ct6": 0,
-            "ive1": 0,
-            "ivi1": 0,
-            "bdp1": 0,
-            "bcp1": 0,
-            "pvp1": 0,
-        }
         if resolution == MINUTE:
             url = f"/cgi-jday-{self.prefix}{self._serialno}-{date_from.year}-{date_from.month}-{date_from.day}-{date_from.hour}-0-{how_long}"
         else:
@@ -147,15 +155,7 @@ class BaseDevice(ABC):
         if raw_response:
             return data
 
-        for row in data:
-            for key in energy_wh:
-                if key in ["ct1", "ct2", "ct3", "ct4", "ct5", "ct6"]:
-                    watt_hours = (
-                        row.get(f"pe{key}", 0) / 3600 - row.get(f"ne{key}", 0) / 3600
-                    )
-                else:
-                    watt_hours = row.get(key, 0) / 3600
-                energy_wh[key] = energy_wh[key] + watt_hours
+        energy_wh = sum_energy(data)
 
         device_boosted = round(
             (energy_wh["h1b"] + energy_wh["h2b"] + energy_wh["h3b"]) / 1000, 2
@@ -179,14 +179,12 @@ class BaseDevice(ABC):
         if resolution == MINUTE:
             return_data["pv_total"] = round(energy_wh["pvp1"] / 1000, 2)
 
-        for i in range(6):
-            key = f"ct{i+1}"
-            if hasattr(self, key):
-                ct_key = getattr(self, key).name_as_key
-                if ct_key != "ct_none":
-                    return_data[ct_key] = round(
-                        (return_data.get(ct_key, 0) + (energy_wh[f"ct{i+1}"] / 1000)), 2
-                    )
+        for slot in self.ct_slots:
+            ct_key = _ct_key(self._data.get(CT_NAME_KEYS[slot], "None"))
+            if ct_key != "ct_none":
+                return_data[ct_key] = round(
+                    (return_data.get(ct_key, 0) + (energy_wh[f"ct{slot}"] / 1000)), 2
+                )
         return return_data
 
     @property
@@ -203,6 +201,11 @@ class BaseDevice(ABC):
         """Serial Number"""
         return self._data.get("sno", None)
 
+    @property
+    def is_active(self):
+        """Is the device busy, e.g. charging? Active devices are polled more often"""
+        return False
+
     @property
     def firmware_version(self):
         """Firmware version"""
@@ -234,13 +237,20 @@ class BaseDevice(ABC):
         return self._data
 
     def refresh_ct_groups(self):
+        """Update ct_assignments and the CT power per group from data"""
+        data = self._data
+        assignments = []
         groups = {}
-        for i in range(6):
-            key = f"ct{i+1}"
-            if hasattr(self, key):
-                ct = getattr(self, key)
-                if ct.name_as_key != "ct_none":
-                    groups[ct.name_as_key] = groups.get(ct.name_as_key, 0) + ct.power
+        for slot in self.ct_slots:
+            name = data.get(CT_NAME_KEYS[slot], "None")
+            if name == "None":
+                continue
+            assignments.append((slot, name, data.get(CT_PHASE_KEYS[slot])))
+            key = _ct_key(name)
+            if key != "ct_none":
+                groups[key] = groups.get(key, 0) + data.get(CT_POWER_KEYS[slot], 0)
+        # (slot, name, phase) of the assigned CTs
+        self.ct_assignments = tuple(assignments)
         self.ct_groups = groups
 
     @data.setter
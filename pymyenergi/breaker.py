@@ -0,0 +1,114 @@
+#  SPDX-License-Identifier: Apache-2.0
+"""
+Circuit breakers for the myenergi servers.
+
+"""
+import logging
+import time
+
+from .exceptions import CircuitOpenException
+
+_LOGGER = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Circuit breaker for one host.
+
+    After ``failure_threshold`` consecutive failures (server errors, timeouts
+    and connection problems) the circuit opens and requests fail fast with
+    ``CircuitOpenException``. After ``reset_timeout`` seconds it is half open
+    and lets ``half_open_max`` probe requests through; the circuit closes
+    again when a probe succeeds and reopens when one fails.
+    """
+
+    def __init__(
+        self,
+        host,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        half_open_max: int = 1,
+    ) -> None:
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max
+        self.failures = 0
+        self._opened_at = None
+        self._probes = 0
+
+    @property
+    def state(self):
+        """closed, open or half_open"""
+        if self._opened_at is None:
+            return CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def before_request(self):
+        """Raise CircuitOpenException unless a request may be sent now"""
+        state = self.state
+        if state == CLOSED:
+            return
+        if state == HALF_OPEN and self._probes < self.half_open_max:
+            self._probes += 1
+            _LOGGER.debug(f"Circuit for {self.host} half open, sending probe")
+            return
+        raise CircuitOpenException(self.host)
+
+    def record_success(self):
+        if self._opened_at is not None:
+            _LOGGER.info(f"Circuit for {self.host} closed")
+        self.failures = 0
+        self._opened_at = None
+        self._probes = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self._opened_at is not None:
+            # A failed probe opens the circuit for another reset_timeout
+            self._opened_at = time.monotonic()
+            self._probes = 0
+        elif self.failures >= self.failure_threshold:
+            _LOGGER.warning(
+                f"Circuit for {self.host} opened after {self.failures} failures"
+            )
+            self._opened_at = time.monotonic()
+
+    def abandon(self):
+        """Release a probe that finished without a result, e.g. cancelled"""
+        if self._probes:
+            self._probes -= 1
+
+
+class CircuitBreakers:
+    """Circuit breakers keyed per host, shareable by several connections"""
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        half_open_max: int = 1,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max
+        self._breakers = {}
+
+    def get(self, host):
+        """Circuit breaker for host"""
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = CircuitBreaker(
+                host, self.failure_threshold, self.reset_timeout, self.half_open_max
+            )
+        return breaker
+
+    def is_open(self, host):
+        """Would a request to host fail fast right now?"""
+        breaker = self._breakers.get(host)
+        return breaker is not None and breaker.state == OPEN
@@ -0,0 +1,106 @@
+#  SPDX-License-Identifier: Apache-2.0
+"""
+Response cache for rarely changing myenergi API endpoints.
+
+"""
+import re
+import time
+from collections import OrderedDict
+
+# URL pattern -> seconds a successful GET response is cached
+DEFAULT_TTLS = {
+    r"^/cgi-get-app-key-$": 3600,
+    r"^/cgi-boost-time-Z\d+$": 300,
+    r"^/api/AccountAccess/LibbiMode\?serialNo=": 300,
+    r"^/api/AccountAccess/[^/?]+/LibbiChargeSetup$": 300,
+}
+
+# URL pattern of a write -> URL patterns of the cached responses it makes stale
+DEFAULT_INVALIDATIONS = {
+    r"^/cgi-zappi-mode-": [r"^/cgi-boost-time-"],
+    r"^/cgi-boost-time-Z\d+-": [r"^/cgi-boost-time-"],
+    r"^/api/AccountAccess/LibbiMode\?chargeFromGrid=": [
+        r"^/api/AccountAccess/LibbiMode"
+    ],
+    r"^/api/AccountAccess/[^/?]+/TargetEnergy": [
+        r"^/api/AccountAccess/[^/?]+/LibbiChargeSetup"
+    ],
+}
+
+MISSING = object()
+
+
+class ResponseCache:
+    """Bounded LRU cache of parsed GET responses with per-URL-pattern TTLs.
+
+    Only GETs whose URL matches one of ``ttls`` are cached. Any other
+    successful request whose URL matches a key of ``invalidations`` drops the
+    cached responses of the related endpoints for that hub. Cached responses
+    are shared with every caller and must not be modified.
+    """
+
+    def __init__(self, ttls=None, invalidations=None, max_entries: int = 256) -> None:
+        self.ttls = [
+            (re.compile(pattern), ttl)
+            for pattern, ttl in (DEFAULT_TTLS if ttls is None else ttls).items()
+        ]
+        self.invalidations = [
+            (re.compile(pattern), [re.compile(target) for target in targets])
+            for pattern, targets in (
+                DEFAULT_INVALIDATIONS if invalidations is None else invalidations
+            ).items()
+        ]
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def ttl(self, url):
+        """Seconds a response for url is cached, or None when not cacheable"""
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return None
+
+    def get(self, hub, url, oauth=False):
+        """Cached response, or MISSING"""
+        key = (str(hub), url, oauth)
+        entry = self._entries.get(key)
+        if entry is None:
+            return MISSING
+        expires, response = entry
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return MISSING
+        self._entries.move_to_end(key)
+        return response
+
+    def store(self, hub, method, url, oauth, response):
+        """Record the response of a successful request"""
+        if method == "GET":
+            ttl = self.ttl(url)
+            if ttl is not None:
+                key = (str(hub), url, oauth)
+                self._entries[key] = (time.monotonic() + ttl, response)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                return
+        self.invalidate(hub, url)
+
+    def discard(self, hub, url, oauth=False):
+        """Drop the cached response for url"""
+        self._entries.pop((str(hub), url, oauth), None)
+
+    def invalidate(self, hub, url):
+        """Drop cached responses made stale by a write to url"""
+        for pattern, targets in self.invalidations:
+            if pattern.search(url):
+                for key in list(self._entries):
+                    if key[0] == str(hub) and any(t.search(key[1]) for t in targets):
+                        del self._entries[key]
+
+    def clear(self):
+        """Drop all cached responses"""
+        self._entries.clear()
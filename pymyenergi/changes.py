@@ -0,0 +1,96 @@
+#  SPDX-License-Identifier: Apache-2.0
+"""
+Change detection for device data.
+
+"""
+import asyncio
+
+_MISSING = object()
+
+
+def diff_data(old, new):
+    """Fields that differ between two device data dicts.
+
+    Returns ``{field: (old_value, new_value)}``, with ``None`` for a field
+    missing on one side.
+    """
+    if old == new:
+        return {}
+    changes = {}
+    for key, value in new.items():
+        previous = old.get(key, _MISSING)
+        if previous is _MISSING:
+            changes[key] = (None, value)
+        elif previous != value:
+            changes[key] = (previous, value)
+    for key, previous in old.items():
+        if key not in new:
+            changes[key] = (previous, None)
+    return changes
+
+
+class DeviceChange:
+    """Changed fields of one device after a refresh.
+
+    ``changes`` maps each changed field of ``device.data`` to
+    ``(old_value, new_value)``. ``added`` is True the first time a device is
+    seen, all its fields are then reported with an old value of ``None``.
+    """
+
+    __slots__ = ("device", "changes", "added")
+
+    def __init__(self, device, changes, added=False) -> None:
+        self.device = device
+        self.changes = changes
+        self.added = added
+
+    @property
+    def serial_number(self):
+        return self.device.serial_number
+
+    @property
+    def kind(self):
+        return self.device.kind
+
+    def __contains__(self, field):
+        return field in self.changes
+
+    def __repr__(self):
+        fields = ", ".join(self.changes)
+        return f"DeviceChange({self.device!r}, {fields})"
+
+
+class ChangeStream:
+    """Async iterator over the device changes of a client.
+
+    Changes are queued from the moment the stream is created until
+    ``close()`` is called, so none are missed between two iterations.
+    """
+
+    _CLOSED = object()
+
+    def __init__(self, streams) -> None:
+        self._queue = asyncio.Queue()
+        self._streams = streams
+        self._closed = False
+        streams.append(self)
+
+    def put(self, change):
+        self._queue.put_nowait(change)
+
+    def close(self):
+        """Stop receiving changes and end the iteration"""
+        if not self._closed:
+            self._closed = True
+            self._streams.remove(self)
+            self._queue.put_nowait(self._CLOSED)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        change = await self._queue.get()
+        if change is self._CLOSED:
+            self._queue.put_nowait(change)
+            raise StopAsyncIteration
+        return change
@@ -46,13 +46,19 @@ async def main(args):
     else:
         app_email = ""
         app_password = ""
-    conn = Connection(username, password, app_password, app_email)
-    if app_email and app_password:
-        await conn.discoverLocations()
+    conn = Connection(
+        username,
+        password,
+        app_password,
+        app_email,
+        asn_cache=args.asn_cache or None,
+    )
     if args.debug:
         logging.root.setLevel(logging.DEBUG)
     client = MyenergiClient(conn)
     try:
+        if app_email and app_password:
+            await conn.discoverLocations()
         if args.command == "list":
             devices = await client.get_devices(args.kind)
             for device in devices:
@@ -171,11 +177,19 @@ async def main(args):
             )
     except WrongCredentials:
         sys.exit("Wrong username or password")
+    finally:
+        await conn.close()
 
 
 def cli():
     config = configparser.ConfigParser()
-    config["hub"] = {"serial": "", "password": "", "app_password": "", "app_email": ""}
+    config["hub"] = {
+        "serial": "",
+        "password": "",
+        "app_password": "",
+        "app_email": "",
+        "asn_cache": "~/.myenergi_asn.json",
+    }
     config.read([".myenergi.cfg", os.path.expanduser("~/.myenergi.cfg")])
     parser = argparse.ArgumentParser(prog="myenergi", description="myenergi CLI.")
     parser.add_argument(
@@ -202,6 +216,12 @@ def cli():
         dest="app_email",
         default=config.get("hub", "app_email").strip('"'),
     )
+    parser.add_argument(
+        "--asn-cache",
+        dest="asn_cache",
+        default=config.get("hub", "asn_cache").strip('"'),
+        help="file used to remember the hub's active server, empty to disable",
+    )
     parser.add_argument(
         "--skip-oauth", dest="skip_oauth", action="store_true", default=False
     )
@@ -1,8 +1,12 @@
+import asyncio
 import logging
+import time
 from datetime import datetime
 from datetime import timezone
+from functools import partial
 
 from pymyenergi.connection import Connection
+from pymyenergi.connection import request_deadline
 
 from . import CT_BATTERY
 from . import CT_GENERATION
@@ -16,9 +20,16 @@ from . import HOUR
 from . import LIBBI
 from . import VOLTAGE_GRID
 from . import ZAPPI
+from .base_device import CT_POWER_KEYS
+from .changes import ChangeStream
+from .changes import DeviceChange
+from .changes import diff_data
 from .eddi import Eddi
 from .harvi import Harvi
 from .libbi import Libbi
+from .polling import Poller
+from .snapshot import read_snapshot
+from .snapshot import write_snapshot
 from .zappi import Zappi
 
 _LOGGER = logging.getLogger(__name__)
@@ -43,15 +54,87 @@ class MyenergiClient:
     def __init__(
         self,
         connection: Connection,
+        max_concurrency: int = 4,
+        keys_ttl: float = 3600,
     ) -> None:
         self._connection = connection
+        self.max_concurrency = max_concurrency
+        self._concurrency_limit = None
+        self.keys_ttl = keys_ttl
         self.devices = {}
         self._data = []
         self._keys = None
+        self._key_index = {}
+        self._keys_expire = None
+        self._keys_invalid = False
+        self._unknown_serials = set()
+        self._devices_by_kind = {}
         self._totals = {}
         self._history_totals = {}
         self._update_available = False
         self._firmware_version = ""
+        self._change_callbacks = []
+        self._change_streams = []
+        self._poller = None
+        self.snapshot_time = None
+        self._ct_signature = None
+        self._ct_index = []
+        self._ct_main_device = None
+
+    def save_snapshot(self, path):
+        """Save keys, device data and history totals to a file"""
+        write_snapshot(
+            path,
+            {
+                "serial": str(self.serial_number),
+                "saved_at": time.time(),
+                "asn": self._connection.server_host,
+                "keys": self._keys,
+                "devices": self._data,
+                "firmware_version": self._firmware_version,
+                "history_totals": self._history_totals,
+                "history": {
+                    str(device.serial_number): device.history_data
+                    for device in self.devices.values()
+                    if getattr(device, "history_data", None)
+                },
+                "libbi": {
+                    str(libbi.serial_number): libbi._extra_data
+                    for libbi in self._devices_by_kind.get(LIBBI, ())
+                },
+            },
+        )
+
+    @classmethod
+    def from_snapshot(cls, connection: Connection, path, **kwargs):
+        """Client restored from save_snapshot() without any requests.
+
+        The restored state can be served right away, later refreshes skip
+        the app key request and the director lookup. Raises ValueError if
+        the snapshot was saved for another hub.
+        """
+        snapshot = read_snapshot(path, getattr(connection, "json_decoder", None))
+        if snapshot["serial"] != str(connection.username):
+            raise ValueError(f"Snapshot {path} is for hub {snapshot['serial']}")
+        client = cls(connection, **kwargs)
+        client.snapshot_time = snapshot["saved_at"]
+        if snapshot["asn"] and connection.base_url is None:
+            connection.setServerHost(snapshot["asn"])
+        client._set_keys(snapshot["keys"])
+        if client.keys_ttl is not None:
+            age = time.time() - snapshot["saved_at"]
+            client._keys_expire = time.monotonic() + client.keys_ttl - age
+        client._update_devices(snapshot["devices"])
+        client._firmware_version = snapshot["firmware_version"]
+        for device in client.devices.values():
+            serial = str(device.serial_number)
+            if serial in snapshot["history"]:
+                device.history_data = snapshot["history"][serial]
+            if serial in snapshot["libbi"]:
+                device._extra_data = snapshot["libbi"][serial]
+        client._history_totals = snapshot["history_totals"]
+        client._calculate_totals()
+        return client
 
     @property
     def site_name(self):
@@ -95,56 +178,39 @@ class MyenergiClient:
                 "green", 0
             ) + zappi_or_eddi_or_libbi.history_data.get("device_green", 0)
 
-    def _calculate_totals(self):
-        """Calculate current data totals"""
-        devices = self.get_devices_sync()
-        self._totals = {}
-        zappi_or_eddi_or_libbi = None
-        self._totals[CT_GRID] = 0
-        self._totals[CT_GENERATION] = 0
+    def _update_ct_index(self, devices):
+        """Rebuild the CT index if devices or CT assignments have changed"""
+        signature = [(device, device.ct_assignments) for device in devices]
+        if signature == self._ct_signature:
+            return
+        self._ct_signature = signature
+        index = []
+        self._ct_main_device = None
         for device in devices:
-            if device.ct1.is_assigned:
-                self._totals[device.ct1.name] = (
-                    self._totals.get(device.ct1.name, 0) + device.ct1.power
-                )
-            if device.ct2.is_assigned:
-                self._totals[device.ct2.name] = (
-                    self._totals.get(device.ct2.name, 0) + device.ct2.power
-                )
+            for slot, name, phase in device.ct_assignments:
+                if slot in device.totals_ct_slots:
+                    index.append((device, slot, name, phase, CT_POWER_KEYS[slot]))
+            if device.kind in (EDDI, ZAPPI, LIBBI):
+                self._ct_main_device = device
+        # (device, slot, name, phase, power data key) of CTs counted in totals
+        self._ct_index = index
 
-            if device.kind in [ZAPPI, HARVI, LIBBI]:
-                if device.ct3.is_assigned:
-                    self._totals[device.ct3.name] = (
-                        self._totals.get(device.ct3.name, 0) + device.ct3.power
-                    )
-            if device.kind == EDDI:
-                zappi_or_eddi_or_libbi = device
-            if device.kind == ZAPPI or device.kind == LIBBI:
-                zappi_or_eddi_or_libbi = device
-                if device.kind == ZAPPI or device.kind == LIBBI:
-                    if device.ct4.is_assigned:
-                        self._totals[device.ct4.name] = (
-                            self._totals.get(device.ct4.name, 0) + device.ct4.power
-                        )
-                    if device.ct5.is_assigned:
-                        self._totals[device.ct5.name] = (
-                            self._totals.get(device.ct5.name, 0) + device.ct5.power
-                        )
-                    if device.ct6.is_assigned:
-                        self._totals[device.ct6.name] = (
-                            self._totals.get(device.ct6.name, 0) + device.ct6.power
-                        )
+    def _calculate_totals(self):
+        """Calculate current data totals"""
+        self._update_ct_index(self.get_devices_sync())
+        totals = {CT_GRID: 0, CT_GENERATION: 0}
+        for device, slot, name, phase, power_key in self._ct_index:
+            totals[name] = totals.get(name, 0) + device.data.get(power_key, 0)
 
+        zappi_or_eddi_or_libbi = self._ct_main_device
         if zappi_or_eddi_or_libbi is not None:
-            self._totals[FREQUENCY_GRID] = zappi_or_eddi_or_libbi.supply_frequency
-            self._totals[VOLTAGE_GRID] = zappi_or_eddi_or_libbi.supply_voltage
-        if self._totals.get(CT_GRID, 0) == 0 and zappi_or_eddi_or_libbi is not None:
-            self._totals[CT_GRID] = zappi_or_eddi_or_libbi.power_grid
-        if (
-            self._totals.get(CT_GENERATION, 0) == 0
-            and zappi_or_eddi_or_libbi is not None
-        ):
-            self._totals[CT_GENERATION] = zappi_or_eddi_or_libbi.power_generated
+            totals[FREQUENCY_GRID] = zappi_or_eddi_or_libbi.supply_frequency
+            totals[VOLTAGE_GRID] = zappi_or_eddi_or_libbi.supply_voltage
+            if totals[CT_GRID] == 0:
+                totals[CT_GRID] = zappi_or_eddi_or_libbi.power_grid
+            if totals[CT_GENERATION] == 0:
+                totals[CT_GENERATION] = zappi_or_eddi_or_libbi.power_generated
+        self._totals = totals
 
     def get_power_totals(self):
         return self._totals
@@ -212,15 +278,54 @@ class MyenergiClient:
 
     def find_device_name(self, key, default_value):
         """Find device or site name"""
-        keys = list(self._keys.values())[0]
-        return next((item["val"] for item in keys if item["key"] == key), default_value)
-
-    async def refresh(self):
-        """Refresh device data"""
+        return self._key_index.get(key, default_value)
+
+    def _set_keys(self, keys):
+        """Store the app keys and index the hub's names by key"""
+        if keys is self._keys:
+            return
+        self._keys = keys
+        index = {}
+        if keys:
+            for item in next(iter(keys.values()), []):
+                # The first entry wins, as with a linear search
+                index.setdefault(item["key"], item["val"])
+        self._key_index = index
+        # Devices may have been renamed
+        for device in self.devices.values():
+            device.name = index.get(self._device_key(device), device.name)
+
+    @staticmethod
+    def _device_key(device):
+        return device.prefix + str(device.serial_number)
+
+    async def refresh(self, deadline=None):
+        """Refresh device data, within deadline seconds if given"""
+        with request_deadline(deadline):
+            await self._refresh()
+
+    async def _refresh(self):
         _LOGGER.debug("Refreshing data for all myenergi devices")
         data = await self.fetch_data()
-        self._data = data["devices"]
-        self._keys = data["keys"]
+        self._set_keys(data["keys"])
+        libbis, changes = self._update_devices(data["devices"])
+        # Update the extra information available on libbi
+        # this is the bit that requires OAuth
+        await self._gather_limited([libbi.refresh_extra for libbi in libbis])
+        self._calculate_totals()
+        for change in changes:
+            self._emit_change(change)
+
+    def _update_devices(self, devices_data):
+        """Create or update devices from a /cgi-jstatus-* payload.
+
+        Returns the Libbi devices in the payload and the device changes.
+        """
+        self._data = devices_data
+        libbis = []
+        # Only diff device data when someone is listening
+        track_changes = bool(self._change_callbacks or self._change_streams)
+        changes = []
         for grp in self._data:
             keys = list(grp.keys())
             key = keys[0]
@@ -243,9 +348,15 @@ class MyenergiClient:
                     existing_device = device_factory(
                         self._connection, key, serial, device_data
                     )
-                    serial_key = existing_device.prefix + str(
-                        existing_device.serial_number
-                    )
+                    serial_key = self._device_key(existing_device)
+                    if (
+                        serial_key not in self._key_index
+                        and serial_key not in self._unknown_serials
+                    ):
+                        # A new device, get its name with the next refresh
+                        _LOGGER.debug(f"No app key for {serial_key}")
+                        self._unknown_serials.add(serial_key)
+                        self.invalidate_keys()
                     existing_device.name = self.find_device_name(
                         serial_key,
                         f"{existing_device.kind}-{existing_device.serial_number}",
@@ -254,40 +365,175 @@ class MyenergiClient:
                         f"Adding {existing_device.kind} {existing_device.name}"
                     )
                     self.devices[serial] = existing_device
-                else:
+                    self._devices_by_kind.setdefault(existing_device.kind, []).append(
+                        existing_device
+                    )
+                    if track_changes:
+                        changes.append(
+                            DeviceChange(
+                                existing_device, diff_data({}, device_data), True
+                            )
+                        )
+                elif device_data != existing_device.data:
                     _LOGGER.debug(
                         f"Updating {existing_device.kind} {existing_device.name}"
                     )
+                    if track_changes:
+                        changes.append(
+                            DeviceChange(
+                                existing_device,
+                                diff_data(existing_device.data, device_data),
+                            )
+                        )
                     existing_device.data = device_data
 
-                # Update the extra information available on libbi
-                # this is the bit that requires OAuth
                 if existing_device.kind == LIBBI:
-                    await existing_device.refresh_extra()
-        self._calculate_totals()
+                    libbis.append(existing_device)
+        return libbis, changes
+
+    def on_change(self, callback):
+        """Call ``callback(change)`` with a ``DeviceChange`` for every device
+        that is added or whose data changes during a refresh"""
+        self._change_callbacks.append(callback)
+        return callback
+
+    def remove_change_callback(self, callback):
+        self._change_callbacks.remove(callback)
+
+    def changes(self):
+        """Stream of ``DeviceChange`` from the following refreshes::
+
+            stream = client.changes()
+            async for change in stream:
+                print(change.device, change.changes)
+
+        Call ``stream.close()`` to stop listening.
+        """
+        return ChangeStream(self._change_streams)
+
+    def _emit_change(self, change):
+        for callback in self._change_callbacks:
+            callback(change)
+        for stream in self._change_streams:
+            stream.put(change)
+
+    async def _gather_limited(self, calls):
+        """Await ``call()`` for each coroutine function concurrently, at most
+        max_concurrency at a time. If one fails the others are cancelled.
+
+        The limit is shared by all calls, so e.g. a status and a history
+        refresh running together stay within max_concurrency between them.
+        """
+        if self._concurrency_limit is None:
+            # Created on first use, inside the running event loop
+            self._concurrency_limit = asyncio.Semaphore(self.max_concurrency)
+        limit = self._concurrency_limit
+
+        async def run(call):
+            async with limit:
+                # Only create the coroutine once it may run, so none is left
+                # unawaited when the gather is cancelled
+                return await call()
+
+        tasks = [asyncio.ensure_future(run(call)) for call in calls]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    def start_polling(
+        self,
+        fast_interval: float = 15,
+        slow_interval: float = 120,
+        history_interval: float = 900,
+    ):
+        """Refresh in the background until stop_polling() is called.
+
+        Status is refreshed every fast_interval seconds while a device is
+        charging, boosting or discharging and every slow_interval seconds
+        otherwise, today's history every history_interval seconds (None
+        turns this off). Use on_change() or changes() to follow the updates.
+        """
+        if self._poller is not None and self._poller.is_running:
+            raise RuntimeError("Already polling")
+        self._poller = Poller(self, fast_interval, slow_interval, history_interval)
+        self._poller.start()
+        return self._poller
+
+    async def stop_polling(self):
+        """Stop background polling"""
+        if self._poller is not None:
+            await self._poller.stop()
+            self._poller = None
+
+    @property
+    def is_polling(self):
+        return self._poller is not None and self._poller.is_running
 
     async def refresh_history_today(self):
         today = datetime.now(timezone.utc)
         today = today.replace(hour=0, minute=0, second=0, microsecond=0)
         return await self.refresh_history(today, 24, HOUR)
 
-    async def refresh_history(self, from_date, how_long, resolution):
-        """Refresh history data for eddi and zappi"""
+    async def refresh_history(self, from_date, how_long, resolution, deadline=None):
+        """Refresh history data for eddi and zappi, within deadline seconds if given"""
+        with request_deadline(deadline):
+            await self._refresh_history(from_date, how_long, resolution)
+
+    async def _refresh_history(self, from_date, how_long, resolution):
         devices = await self.get_devices("all", False)
-        for device in devices:
-            if device.kind == HARVI:
-                continue
-            await device.refresh_history_data(from_date, how_long, resolution)
+        await self._gather_limited(
+            [
+                partial(device.refresh_history_data, from_date, how_long, resolution)
+                for device in devices
+                if device.kind != HARVI
+            ]
+        )
         self._calculate_history_totals()
 
+    def _keys_stale(self):
+        if self._keys is None or self._keys_invalid:
+            return True
+        return self._keys_expire is not None and self._keys_expire <= time.monotonic()
+
+    def invalidate_keys(self):
+        """Fetch the app keys (device names) again with the next refresh"""
+        self._keys_invalid = True
+
     async def fetch_data(self):
-        """Fetch data from myenergi"""
-        keys = self._keys
-        if keys is None:
+        """Fetch data from myenergi, the app keys too when they are stale"""
+        if not self._keys_stale():
+            devices = await self._connection.get("/cgi-jstatus-*")
+            return {"devices": devices, "keys": self._keys}
+        cache = getattr(self._connection, "response_cache", None)
+        if cache is not None and self._keys_invalid:
+            cache.discard(self._connection.username, "/cgi-get-app-key-")
+        if self._keys is None:
+            # The first request also answers the digest challenge for the
+            # one that follows
             keys = await self._connection.get("/cgi-get-app-key-")
-        devices = await self._connection.get("/cgi-jstatus-*")
-        data = {"devices": devices, "keys": keys}
-        return data
+            devices = await self._connection.get("/cgi-jstatus-*")
+        else:
+            keys, devices = await asyncio.gather(
+                self._connection.get("/cgi-get-app-key-"),
+                self._connection.get("/cgi-jstatus-*"),
+                return_exceptions=True,
+            )
+            if isinstance(devices, BaseException):
+                raise devices
+            if isinstance(keys, Exception):
+                # Keep the names we have, the next refresh tries again
+                _LOGGER.debug(f"Refetching app keys failed: {keys!r}")
+                return {"devices": devices, "keys": self._keys}
+            if isinstance(keys, BaseException):
+                raise keys
+        self._keys_invalid = False
+        if self.keys_ttl is not None:
+            self._keys_expire = time.monotonic() + self.keys_ttl
+        return {"devices": devices, "keys": keys}
 
     async def get_devices(self, kind="all", refresh=True):
         """Fetch devices, all or of a specific kind"""
@@ -297,15 +543,20 @@ class MyenergiClient:
 
     def get_devices_sync(self, kind="all"):
         """Return current devices"""
-        all_devices = list(self.devices.values())
         if kind == "all":
-            return all_devices
-        return list(filter(lambda d: (d.kind == kind), all_devices))
+            return list(self.devices.values())
+        return list(self._devices_by_kind.get(kind, ()))
 
     async def show(self):
         out = ""
-        devices = await self.get_devices()
-        await self.refresh_history_today()
+        if self.devices:
+            # Devices are known, fetch status and history at the same time
+            await asyncio.gather(self.refresh(), self.refresh_history_today())
+            self._calculate_history_totals()
+        else:
+            await self.refresh()
+            await self.refresh_history_today()
+        devices = self.get_devices_sync()
         out = f"Site name: {self.site_name}\n"
         out = out + f"Home consumption             : {self.consumption_home}W\n"
         out = out + f"Power grid                   : {self.power_grid}W\n"
@@ -3,20 +3,64 @@
 Python Package for connecting to myenergi API.
 
 """
+import asyncio
 import logging
 import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
 from typing import Text
 
 import httpx
-from pycognito import Cognito
 
+from .asn_cache import AsnCache
+from .auth import PreemptiveDigestAuth
+from .cache import MISSING
+from .decoder import get_decoder
+from .exceptions import CircuitOpenException
 from .exceptions import MyenergiException
 from .exceptions import TimeoutException
 from .exceptions import WrongCredentials
+from .metrics import RequestTrace
+from .oauth import TokenManager
+from .retry import parse_retry_after
 
 _LOGGER = logging.getLogger(__name__)
-_USER_POOL_ID = "eu-west-2_E57cCJB20"
-_CLIENT_ID = "2fup0dhufn5vurmprjkj599041"
+_DEADLINE = ContextVar("pymyenergi_deadline", default=None)
+_TIMEOUT_CODES = {
+    httpx.ConnectTimeout: "CONNECT_TIMEOUT",
+    httpx.ReadTimeout: "READ_TIMEOUT",
+    httpx.WriteTimeout: "WRITE_TIMEOUT",
+    httpx.PoolTimeout: "POOL_TIMEOUT",
+}
+
+
+@contextmanager
+def request_deadline(seconds):
+    """Bound the total time of all requests made inside the block.
+
+    Every request sent within ``seconds``, including director lookups, digest
+    challenges, retries and reading the body, raises ``TimeoutException``
+    with code ``DEADLINE_EXCEEDED`` once the deadline has passed. Nested
+    deadlines can only shorten an outer one. ``None`` sets no deadline.
+    """
+    if seconds is None:
+        yield
+        return
+    expires = time.monotonic() + seconds
+    outer = _DEADLINE.get()
+    if outer is not None:
+        expires = min(expires, outer)
+    token = _DEADLINE.set(expires)
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+def _timeoutError(error):
+    return TimeoutException(_TIMEOUT_CODES.get(type(error), "TIMEOUT"))
 
 
 class Connection:
@@ -28,41 +72,219 @@ class Connection:
         password: Text = None,
         app_password: Text = None,
         app_email: Text = None,
-        timeout: int = 20,
-        asyncClient=httpx.AsyncClient(),
+        timeout: float = 20,
+        asyncClient: httpx.AsyncClient = None,
+        max_connections: int = 10,
+        max_keepalive_connections: int = 5,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        asn_cache=None,
+        oauth_refresh_margin: float = 300,
+        retry_policy=None,
+        rate_limiter=None,
+        coalesce_requests: bool = True,
+        response_cache=None,
+        json_decoder=None,
+        metrics=None,
+        connect_timeout: float = None,
+        read_timeout: float = None,
+        write_timeout: float = None,
+        pool_timeout: float = None,
+        circuit_breakers=None,
     ) -> None:
-        """Initialize connection object."""
-        self.timeout = timeout
+        """Initialize connection object.
+
+        Unless an existing ``asyncClient`` is passed in, the connection builds
+        and owns its own pooled httpx client, which is closed by ``close()``
+        or when leaving an ``async with`` block. A client passed in by the
+        caller is shared and left open.
+
+        ``asn_cache`` is an optional path (or ``AsnCache``) where the active
+        server of each hub is remembered between runs, so a new connection
+        can skip the initial director lookup.
+
+        App credentials are authenticated lazily on the first OAuth request,
+        and the access token is renewed in the background
+        ``oauth_refresh_margin`` seconds before it expires. If renewal fails
+        the current token is used, and renewal retried, until it expires.
+
+        Failed requests are retried according to ``retry_policy`` (a
+        ``RetryPolicy``), by default they are not retried. A ``RateLimiter``
+        passed as ``rate_limiter`` queues requests per hub and host.
+
+        With ``coalesce_requests`` identical concurrent GETs share a single
+        request, and all callers receive the same parsed response object.
+        A ``ResponseCache`` passed as ``response_cache`` serves rarely
+        changing endpoints from memory until their TTL expires.
+
+        Responses are decoded with ``json_decoder``, a name (``"orjson"``,
+        ``"msgspec"`` or ``"json"``) or a function taking bytes. By default
+        the fastest installed decoder is used.
+
+        Callbacks registered with ``on_request_start`` and ``on_request_end``
+        receive a ``RequestTrace`` for every HTTP request. ``metrics`` (a
+        ``RequestMetrics``) collects per-endpoint counters and latencies.
+
+        ``timeout`` applies to each phase of a request that has no specific
+        ``connect_timeout``, ``read_timeout``, ``write_timeout`` or
+        ``pool_timeout``. Use ``request_deadline()`` to bound a whole sequence of
+        requests.
+
+        With ``circuit_breakers`` (a ``CircuitBreakers``) requests to a host
+        that keeps failing fail fast with ``CircuitOpenException``.
+        """
+        self.circuit_breakers = circuit_breakers
+        self.timeout = httpx.Timeout(
+            timeout,
+            connect=timeout if connect_timeout is None else connect_timeout,
+            read=timeout if read_timeout is None else read_timeout,
+            write=timeout if write_timeout is None else write_timeout,
+            pool=timeout if pool_timeout is None else pool_timeout,
+        )
         self.director_url = "https://director.myenergi.net"
         self.base_url = None
+        self._owns_client = asyncClient is None
+        if asyncClient is None:
+            asyncClient = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_keepalive_connections,
+                    keepalive_expiry=keepalive_expiry,
+                ),
+                http2=http2,
+            )
         self.asyncClient = asyncClient
         self.oauth_base_url = "https://myaccount.myenergi.com"
         self.username = username
         self.password = password
         self.app_password = app_password
         self.app_email = app_email
-        self.auth = httpx.DigestAuth(self.username, self.password)
+        self.auth = PreemptiveDigestAuth(self.username, self.password)
         self.headers = {"User-Agent": "Wget/1.14 (linux-gnu)"}
+        self.retry_policy = retry_policy
+        self.rate_limiter = rate_limiter
+        self.coalesce_requests = coalesce_requests
+        self.response_cache = response_cache
+        self.json_decoder = get_decoder(json_decoder)
+        self._request_start_hooks = []
+        self._request_end_hooks = []
+        self.metrics = metrics
+        if metrics is not None:
+            self.on_request_end(metrics.record)
+        self._inflight = {}
+        self._inflight_waiters = {}
+        self.token_manager = None
         if self.app_email and self.app_password:
-            self.oauth = Cognito(_USER_POOL_ID, _CLIENT_ID, username=self.app_email)
-            self.oauth.authenticate(password=self.app_password)
-            self.oauth_headers = {"Authorization": f"Bearer {self.oauth.access_token}"}
+            self.token_manager = TokenManager(
+                self.app_email, self.app_password, oauth_refresh_margin
+            )
+            self.oauth = self.token_manager.cognito
         self.do_query_asn = True
+        self._asn_lookup = None
+        if isinstance(asn_cache, str):
+            asn_cache = AsnCache(asn_cache)
+        self.asn_cache = asn_cache
+        if self.asn_cache is not None and self.username:
+            asn = self.asn_cache.get(self.username)
+            if asn:
+                _LOGGER.debug(f"Using cached myenergi active server {asn}")
+                self.setServerHost(asn)
         self.invitation_id = ""
         _LOGGER.debug("New connection created")
 
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def is_closed(self):
+        """Has the underlying HTTP client been closed?"""
+        return self.asyncClient.is_closed
+
+    async def close(self):
+        """Close the HTTP client if it is owned by this connection"""
+        if self.token_manager is not None:
+            await self.token_manager.close()
+        if self._owns_client and not self.asyncClient.is_closed:
+            await self.asyncClient.aclose()
+            _LOGGER.debug("Connection closed")
+
     def _checkMyenergiServerURL(self, responseHeader):
         if "X_MYENERGI-asn" in responseHeader:
-            new_url = "https://" + responseHeader["X_MYENERGI-asn"]
+            asn = responseHeader["X_MYENERGI-asn"]
+            new_url = "https://" + asn
             if new_url != self.base_url:
                 _LOGGER.info(f"Updated myenergi active server to {new_url}")
             self.base_url = new_url
+            if self.asn_cache is not None:
+                self.asn_cache.set(self.username, asn)
         else:
             _LOGGER.debug(
                 "Myenergi ASN not found in Myenergi header, assume auth failure (bad username)"
             )
             raise WrongCredentials()
 
+    @property
+    def server_host(self):
+        """Host of the myenergi active server, if known"""
+        if self.base_url is None:
+            return None
+        return httpx.URL(self.base_url).host
+
+    def setServerHost(self, asn):
+        """Use a known active server host without asking the director first"""
+        self.base_url = "https://" + asn
+        self.do_query_asn = False
+
+    def _invalidateServerURL(self):
+        # Make sure to query for ASN next request, might be a server problem
+        self.do_query_asn = True
+        if self.asn_cache is not None:
+            self.asn_cache.invalidate(self.username)
+
+    async def _fetchServerURL(self):
+        _LOGGER.debug("Get Myenergi base url from director")
+        try:
+            directorUrl = self.director_url + "/cgi-jstatus-E"
+            await self._throttle(directorUrl)
+            response, _ = await self._request(
+                "director",
+                "GET",
+                "/cgi-jstatus-E",
+                directorUrl,
+                decode=False,
+                auth=self.auth,
+                headers=self.headers,
+                timeout=self.timeout,
+            )
+        except Exception as error:
+            _LOGGER.error("Myenergi server request problem")
+            _LOGGER.debug(sys.exc_info()[0])
+            # Carry on with the previous active server if there is one
+            if self.base_url is None:
+                if isinstance(error, httpx.TimeoutException):
+                    raise _timeoutError(error)
+                raise
+        else:
+            self.do_query_asn = False
+            self._checkMyenergiServerURL(response.headers)
+
+    def _clearServerURLQuery(self, lookup):
+        if self._asn_lookup is lookup:
+            self._asn_lookup = None
+
+    async def _queryServerURL(self):
+        # Concurrent callers share one in-flight director lookup. The lookup is
+        # shielded so a cancelled caller does not abort it for the others.
+        lookup = self._asn_lookup
+        if lookup is None:
+            lookup = asyncio.ensure_future(self._fetchServerURL())
+            lookup.add_done_callback(self._clearServerURLQuery)
+            self._asn_lookup = lookup
+        await asyncio.shield(lookup)
+
     async def discoverLocations(self):
         if self.app_email and self.app_password:
             locs = await self.get("/api/Location", oauth=True)
@@ -73,13 +295,134 @@ class Connection:
                 ]
 
     def checkAndUpdateToken(self):
+        """Blocking token check, tokens are now renewed automatically by send()"""
         # check if we have oauth credentials
-        if self.app_email and self.app_password:
+        if self.token_manager is not None and self.oauth.access_token:
             # check if we have to renew out token
             self.oauth.check_token()
-            self.oauth_headers = {"Authorization": f"Bearer {self.oauth.access_token}"}
+
+    async def _throttle(self, url):
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(self.username, httpx.URL(url).host)
+
+    def on_request_start(self, callback):
+        """Call ``callback(trace)`` before each HTTP request is sent"""
+        self._request_start_hooks.append(callback)
+        return callback
+
+    def on_request_end(self, callback):
+        """Call ``callback(trace)`` when each HTTP request has finished"""
+        self._request_end_hooks.append(callback)
+        return callback
+
+    async def _request(self, path, method, url, theUrl, decode=True, **kwargs):
+        """Send one HTTP request through the circuit breaker of its host"""
+        if self.circuit_breakers is None:
+            return await self._tracedRequest(
+                path, method, url, theUrl, decode, **kwargs
+            )
+        breaker = self.circuit_breakers.get(httpx.URL(theUrl).host)
+        breaker.before_request()
+        try:
+            response, data = await self._tracedRequest(
+                path, method, url, theUrl, decode, **kwargs
+            )
+        except httpx.TransportError:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.abandon()
+            raise
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response, data
+
+    async def _tracedRequest(self, path, method, url, theUrl, decode, **kwargs):
+        """Send one HTTP request, decode a 200 response and report to the hooks"""
+        if not self._request_start_hooks and not self._request_end_hooks:
+            response = await self.asyncClient.request(method, theUrl, **kwargs)
+            data = None
+            if decode and response.status_code == 200:
+                data = self.json_decoder(response.content)
+            return response, data
+
+        trace = RequestTrace(method, url, path)
+        for hook in self._request_start_hooks:
+            hook(trace)
+        data = None
+        try:
+            response = await self.asyncClient.request(method, theUrl, **kwargs)
+            trace.elapsed = time.perf_counter() - trace.started
+            trace.status_code = response.status_code
+            trace.bytes = len(response.content)
+            trace.challenges = sum(1 for r in response.history if r.status_code == 401)
+            if decode and response.status_code == 200:
+                decode_started = time.perf_counter()
+                data = self.json_decoder(response.content)
+                trace.decode_time = time.perf_counter() - decode_started
+        except Exception as error:
+            if trace.elapsed is None:
+                trace.elapsed = time.perf_counter() - trace.started
+            trace.error = error
+            raise
+        finally:
+            for hook in self._request_end_hooks:
+                hook(trace)
+        return response, data
+
+    def _statusError(self, response):
+        error = MyenergiException(response.status_code)
+        error.retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        return error
+
+    async def _withinDeadline(self, make_awaitable, description):
+        """Await make_awaitable(), bounded by the caller's request_deadline"""
+        expires = _DEADLINE.get()
+        if expires is None:
+            return await make_awaitable()
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutException("DEADLINE_EXCEEDED")
+        try:
+            return await asyncio.wait_for(make_awaitable(), remaining)
+        except asyncio.TimeoutError:
+            _LOGGER.debug(f"{description} deadline exceeded")
+            raise TimeoutException("DEADLINE_EXCEEDED")
 
     async def send(self, method, url, json=None, oauth=False):
+        return await self._withinDeadline(
+            partial(self._sendWithRetries, method, url, json, oauth), f"{method} {url}"
+        )
+
+    async def _sendWithRetries(self, method, url, json=None, oauth=False):
+        cache = self.response_cache
+        if cache is not None and method == "GET":
+            response = cache.get(self.username, url, oauth)
+            if response is not MISSING:
+                _LOGGER.debug(f"GET {url} served from cache")
+                return response
+        attempt = 1
+        while True:
+            try:
+                response = await self._send(method, url, json, oauth)
+                if cache is not None:
+                    cache.store(self.username, method, url, oauth, response)
+                return response
+            except (MyenergiException, httpx.TransportError) as error:
+                if self.retry_policy is None:
+                    raise
+                delay = self.retry_policy.delay(attempt, error, method, url, oauth)
+                if delay is None:
+                    raise
+                _LOGGER.debug(
+                    f"{method} {url} failed ({error!r}), retry {attempt} in {delay:.1f}s"
+                )
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _send(self, method, url, json=None, oauth=False):
         # Use OAuth for myaccount.myenergi.com
         if oauth:
             # check if we have oauth credentials
@@ -91,74 +434,111 @@ class Connection:
                         theUrl = theUrl + "&invitationId=" + self.invitation_id
                     else:
                         theUrl = theUrl + "?invitationId=" + self.invitation_id
-                try:
-                    _LOGGER.debug(f"{method} {url} {theUrl}")
-                    response = await self.asyncClient.request(
-                        method,
-                        theUrl,
-                        json=json,
-                        headers=self.oauth_headers,
-                        timeout=self.timeout,
-                    )
-                except httpx.ReadTimeout:
-                    raise TimeoutException()
-                else:
+                for attempt in range(2):
+                    oauth_headers = await self.token_manager.headers()
+                    token = self.token_manager.access_token
+                    await self._throttle(theUrl)
+                    try:
+                        _LOGGER.debug(f"{method} {url} {theUrl}")
+                        response, data = await self._request(
+                            "oauth",
+                            method,
+                            url,
+                            theUrl,
+                            json=json,
+                            headers=oauth_headers,
+                            timeout=self.timeout,
+                        )
+                    except httpx.TimeoutException as error:
+                        raise _timeoutError(error)
                     _LOGGER.debug(f"{method} status {response.status_code}")
-                    if response.status_code == 200:
-                        return response.json()
-                    elif response.status_code == 401:
-                        raise WrongCredentials()
-                    raise MyenergiException(response.status_code)
+                    if response.status_code != 401 or attempt > 0:
+                        break
+                    # Token rejected, renew it once (shared with other callers) and retry
+                    await self.token_manager.invalidate(token)
+                if response.status_code == 200:
+                    return data
+                elif response.status_code == 401:
+                    raise WrongCredentials()
+                raise self._statusError(response)
             else:
                 _LOGGER.error("Trying to use OAuth without app credentials")
 
         # Use Digest Auth for director.myenergi.net and s18.myenergi.net
         else:
             # If base URL has not been set, make a request to director to fetch it
+            if (
+                self.circuit_breakers is not None
+                and self.base_url is not None
+                and self.circuit_breakers.is_open(httpx.URL(self.base_url).host)
+            ):
+                # Fail fast instead of adding director lookups to a degraded server
+                raise CircuitOpenException(httpx.URL(self.base_url).host)
             if self.base_url is None or self.do_query_asn:
-                _LOGGER.debug("Get Myenergi base url from director")
-                try:
-                    directorUrl = self.director_url + "/cgi-jstatus-E"
-                    response = await self.asyncClient.get(
-                        directorUrl,
-                        auth=self.auth,
-                        headers=self.headers,
-                        timeout=self.timeout,
-                    )
-                except Exception:
-                    _LOGGER.error("Myenergi server request problem")
-                    _LOGGER.debug(sys.exc_info()[0])
-                else:
-                    self.do_query_asn = False
-                    self._checkMyenergiServerURL(response.headers)
+                await self._queryServerURL()
             theUrl = self.base_url + url
+            await self._throttle(theUrl)
             try:
                 _LOGGER.debug(f"{method} {url} {theUrl}")
-                response = await self.asyncClient.request(
+                response, data = await self._request(
+                    "digest",
                     method,
+                    url,
                     theUrl,
                     auth=self.auth,
                     headers=self.headers,
                     timeout=self.timeout,
                     json=json,
                 )
-            except httpx.ReadTimeout:
-                # Make sure to query for ASN next request, might be a server problem
-                self.do_query_asn = True
-                raise TimeoutException()
+            except httpx.TimeoutException as error:
+                if not isinstance(error, httpx.PoolTimeout):
+                    self._invalidateServerURL()
+                raise _timeoutError(error)
             else:
                 _LOGGER.debug(f"GET status {response.status_code}")
                 self._checkMyenergiServerURL(response.headers)
                 if response.status_code == 200:
-                    return response.json()
+                    return data
                 elif response.status_code == 401:
                     raise WrongCredentials()
-                # Make sure to query for ASN next request, might be a server problem
-                self.do_query_asn = True
-                raise MyenergiException(response.status_code)
+                self._invalidateServerURL()
+                raise self._statusError(response)
+
+    def _clearInflight(self, key, request):
+        if self._inflight.get(key) is request:
+            del self._inflight[key]
+            self._inflight_waiters.pop(key, None)
+
+    async def _sharedGet(self, url, oauth):
+        # Runs in its own task, every caller applies its own deadline
+        _DEADLINE.set(None)
+        return await self.send("GET", url, None, oauth)
 
     async def get(self, url, data=None, oauth=False):
-        return await self.send("GET", url, data, oauth)
+        if not self.coalesce_requests or data is not None:
+            return await self.send("GET", url, data, oauth)
+        # Identical concurrent GETs share one request and its parsed result
+        key = (url, oauth)
+        request = self._inflight.get(key)
+        if request is None:
+            request = asyncio.ensure_future(self._sharedGet(url, oauth))
+            request.add_done_callback(partial(self._clearInflight, key))
+            self._inflight[key] = request
+            self._inflight_waiters[key] = 0
+        else:
+            _LOGGER.debug(f"GET {url} joins in-flight request")
+        self._inflight_waiters[key] += 1
+        try:
+            return await self._withinDeadline(
+                partial(asyncio.shield, request), f"GET {url}"
+            )
+        finally:
+            if not request.done():
+                self._inflight_waiters[key] -= 1
+                if self._inflight_waiters[key] == 0:
+                    # Every caller gave up, later callers start afresh
+                    self._clearInflight(key, request)
+                    request.cancel()
 
     async def post(self, url, data=None, oauth=False):
         return await self.send("POST", url, data, oauth)
@@ -0,0 +1,46 @@
+#  SPDX-License-Identifier: Apache-2.0
+"""
+JSON decoding of myenergi API responses.
+
+orjson or msgspec are used when installed (``pip install pymyenergi[fast]``),
+otherwise the standard library json module. All decoders work directly on the
+response bytes.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover
+    msgspec = None
+
+
+def _decoders():
+    decoders = {}
+    if orjson is not None:
+        decoders["orjson"] = orjson.loads
+    if msgspec is not None:
+        decoders["msgspec"] = msgspec.json.Decoder().decode
+    decoders["json"] = json.loads
+    return decoders
+
+
+DECODERS = _decoders()
+
+
+def get_decoder(decoder=None):
+    """Decoder function by name, the fastest available when None.
+
+    A callable taking bytes is returned unchanged.
+    """
+    if callable(decoder):
+        return decoder
+    if decoder is None:
+        return next(iter(DECODERS.values()))
+    if decoder not in DECODERS:
+        raise ValueError(f"JSON decoder {decoder} is not available")
+    return DECODERS[decoder]
@@ -25,6 +25,11 @@ EDDI_MODES = ["Stopped", "Normal"]
 class Eddi(BaseDevice):
     """Eddi Client for myenergi API."""
 
+    ct_slots = (1, 2, 3)
+    # The power totals have only ever counted ct1 and ct2 of an eddi, ct3 is
+    # left out so the totals reported for existing sites don't change
+    totals_ct_slots = (1, 2)
+
     def __init__(self, connection: Connection, serialno, data={}) -> None:
         self.history_data = {}
         super().__init__(connection, serialno, data)
@@ -11,6 +11,8 @@ _LOGGER = logging.getLogger(__name__)
 class MyenergiException(Exception):
     """Class of Porsche API exceptions."""
 
+    retry_after = None
+
     def __init__(self, code=None, *args, **kwargs):
         """Initialize exceptions for the Porsche API."""
         self.message = ""
@@ -52,3 +54,11 @@ class TimeoutException(MyenergiException):
     """Class of exceptions for incomplete credentials."""
 
     pass
+
+
+class CircuitOpenException(MyenergiException):
+    """Class of exceptions for requests refused by an open circuit breaker."""
+
+    def __init__(self, host=None, *args, **kwargs):
+        super().__init__("CIRCUIT_OPEN", *args, **kwargs)
+        self.host = host
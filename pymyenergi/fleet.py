@@ -0,0 +1,145 @@
+#  SPDX-License-Identifier: Apache-2.0
+"""
+Manage many myenergi hubs from one process.
+
+"""
+import asyncio
+import logging
+
+import httpx
+
+from .asn_cache import AsnCache
+from .client import MyenergiClient
+from .connection import Connection
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Fleet:
+    """Many hubs sharing one HTTP connection pool.
+
+    Every hub gets its own ``Connection`` and ``MyenergiClient``, all using
+    one pooled httpx client owned by the fleet. ``refresh_all()`` refreshes
+    the hubs concurrently, at most ``max_concurrency`` at a time overall and
+    ``per_host_limit`` at a time per myenergi active server, and yields each
+    hub as soon as it is done. Extra keyword arguments are passed on to every
+    ``Connection``, so e.g. one ``RateLimiter`` or ``RequestMetrics`` can be
+    shared by the whole fleet. An ``asn_cache`` path is opened once and
+    shared by all hubs.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 50,
+        per_host_limit: int = 10,
+        asyncClient: httpx.AsyncClient = None,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        **connection_kwargs,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.per_host_limit = per_host_limit
+        self._owns_client = asyncClient is None
+        if asyncClient is None:
+            asyncClient = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=max_concurrency,
+                    max_keepalive_connections=max_concurrency,
+                    keepalive_expiry=keepalive_expiry,
+                ),
+                http2=http2,
+            )
+        self.asyncClient = asyncClient
+        if isinstance(connection_kwargs.get("asn_cache"), str):
+            connection_kwargs["asn_cache"] = AsnCache(connection_kwargs["asn_cache"])
+        self.connection_kwargs = connection_kwargs
+        self.clients = {}
+        self._host_limits = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def __len__(self):
+        return len(self.clients)
+
+    def add_hub(self, serial, password, app_password=None, app_email=None):
+        """Add a hub, returns its MyenergiClient"""
+        conn = Connection(
+            serial,
+            password,
+            app_password,
+            app_email,
+            asyncClient=self.asyncClient,
+            **self.connection_kwargs,
+        )
+        client = MyenergiClient(conn)
+        self.clients[str(serial)] = client
+        return client
+
+    async def remove_hub(self, serial):
+        """Remove a hub and close its connection"""
+        client = self.clients.pop(str(serial), None)
+        if client is not None:
+            await client._connection.close()
+
+    def _host_limit(self, host):
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = asyncio.Semaphore(self.per_host_limit)
+        return limit
+
+    async def _find_server(self, client, limit):
+        """Look up the active server of a hub that doesn't know it yet"""
+        conn = client._connection
+        if conn.base_url is not None and not conn.do_query_asn:
+            return
+        # Only the director lookup counts against the director's limit
+        async with self._host_limit(httpx.URL(conn.director_url).host):
+            async with limit:
+                await conn._queryServerURL()
+
+    async def _refresh_hub(self, serial, client, limit):
+        try:
+            await self._find_server(client, limit)
+            # Wait for the host before taking a global slot, so hubs queued
+            # for a busy server don't hold slots hubs on other servers could use
+            host = httpx.URL(client._connection.base_url).host
+            async with self._host_limit(host):
+                async with limit:
+                    await client.refresh()
+        except Exception as error:
+            _LOGGER.debug(f"Refreshing hub {serial} failed: {error!r}")
+            return serial, client, error
+        return serial, client, None
+
+    async def refresh_all(self, serials=None):
+        """Refresh hubs concurrently, yielding (serial, client, error) as each finishes
+
+        ``error`` is None when the refresh succeeded, otherwise the exception
+        it raised. ``serials`` limits the refresh to some of the hubs.
+        """
+        limit = asyncio.Semaphore(self.max_concurrency)
+        if serials is None:
+            hubs = list(self.clients.items())
+        else:
+            hubs = [(str(serial), self.clients[str(serial)]) for serial in serials]
+        tasks = [
+            asyncio.ensure_future(self._refresh_hub(serial, client, limit))
+            for serial, client in hubs
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def close(self):
+        """Close all hub connections and the shared HTTP client"""
+        for client in self.clients.values():
+            await client._connection.close()
+        if self._owns_client and not self.asyncClient.is_closed:
+            await self.asyncClient.aclose()
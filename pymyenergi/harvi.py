@@ -7,6 +7,9 @@ from .base_device import BaseDevice
 class Harvi(BaseDevice):
     """Zappi Client for myenergi API."""
 
+    ct_slots = (1, 2, 3)
+    totals_ct_slots = ct_slots
+
     def __init__(self, connection: Connection, serialno, data={}) -> None:
         super().__init__(connection, serialno, data)
 
@@ -0,0 +1,162 @@
+#  SPDX-License-Identifier: Apache-2.0
+"""
+Aggregation of myenergi history rows (``cgi-jday`` and ``cgi-jdayhour``).
+
+Rows hold energy in joules (watt seconds) per minute or hour. ``to_columns()``
+turns rows into columns, NumPy arrays when installed (``pip install
+pymyenergi[fast]``), which ``sum_energy_columns()`` reduces with one sum per
+column.
+"""
+import calendar
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+# Energy totals computed from history rows
+ENERGY_KEYS = (
+    "gep",
+    "gen",
+    "imp",
+    "exp",
+    "h1d",
+    "h1b",
+    "h2d",
+    "h2b",
+    "h3d",
+    "h3b",
+    "ct1",
+    "ct2",
+    "ct3",
+    "ct4",
+    "ct5",
+    "ct6",
+    "ive1",
+    "ivi1",
+    "bdp1",
+    "bcp1",
+    "pvp1",
+)
+CT_KEYS = ("ct1", "ct2", "ct3", "ct4", "ct5", "ct6")
+# Keys summed as they are, CTs are positive minus negative energy
+PLAIN_KEYS = tuple(key for key in ENERGY_KEYS if key not in CT_KEYS)
+POSITIVE_KEYS = tuple(f"pe{key}" for key in CT_KEYS)
+NEGATIVE_KEYS = tuple(f"ne{key}" for key in CT_KEYS)
+COLUMNS = PLAIN_KEYS + POSITIVE_KEYS + NEGATIVE_KEYS
+
+
+def to_columns(rows, keys=COLUMNS, use_numpy=None):
+    """History rows as ``{key: column}`` with 0 for missing values.
+
+    Columns are NumPy float64 arrays when NumPy is installed (or
+    ``use_numpy`` is True), lists otherwise.
+    """
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if use_numpy:
+        return {
+            key: numpy.fromiter(
+                (row.get(key, 0) for row in rows), numpy.float64, len(rows)
+            )
+            for key in keys
+        }
+    return {key: [row.get(key, 0) for row in rows] for key in keys}
+
+
+def _energy_from_sums(sums):
+    energy = {key: sums[key] / 3600 for key in PLAIN_KEYS}
+    for key, positive, negative in zip(CT_KEYS, POSITIVE_KEYS, NEGATIVE_KEYS):
+        energy[key] = (sums[positive] - sums[negative]) / 3600
+    return energy
+
+
+def sum_energy(rows):
+    """Energy in Wh per key of ENERGY_KEYS summed over history rows"""
+    # Summing each key straight from the dicts is faster than converting
+    # the rows to arrays first, the lookups dominate either way
+    return _energy_from_sums(
+        {key: sum(row.get(key, 0) for row in rows) for key in COLUMNS}
+    )
+
+
+def sum_energy_columns(columns):
+    """Energy in Wh per key of ENERGY_KEYS from ``to_columns()`` output.
+
+    Works on NumPy arrays, including 2D arrays of several days stacked along
+    the first axis, and on lists.
+    """
+    sums = {}
+    for key in COLUMNS:
+        column = columns.get(key)
+        if column is None:
+            sums[key] = 0
+        elif numpy is not None and isinstance(column, numpy.ndarray):
+            sums[key] = float(column.sum())
+        else:
+            sums[key] = sum(column)
+    return _energy_from_sums(sums)
+
+
+class HistorySeries:
+    """History as columns aligned on a regular time grid.
+
+    ``timestamp`` holds the POSIX time (UTC) of each minute or hour from the
+    start of the requested period, every key of ``COLUMNS`` (``imp``,
+    ``pect1``, ...) the energy in joules for that period, 0 where the
+    response has no row. Columns are NumPy arrays when NumPy is installed,
+    lists otherwise, and can be read as attributes or with ``series[key]``.
+    """
+
+    __slots__ = ("resolution", "timestamp") + COLUMNS
+
+    def __init__(self, resolution, timestamp, columns) -> None:
+        self.resolution = resolution
+        self.timestamp = timestamp
+        for key in COLUMNS:
+            setattr(self, key, columns[key])
+
+    @classmethod
+    def from_rows(cls, rows, start, length, resolution, step, use_numpy=None):
+        """Series of length periods of step seconds from start (POSIX time)"""
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        columns = {key: [0] * length for key in COLUMNS}
+        day_starts = {}
+        for row in rows:
+            day = (row.get("yr", 1970), row.get("mon", 1), row.get("dom", 1))
+            day_start = day_starts.get(day)
+            if day_start is None:
+                day_start = day_starts[day] = calendar.timegm(day + (0, 0, 0))
+            time = day_start + row.get("hr", 0) * 3600 + row.get("min", 0) * 60
+            index = int(time - start) // step
+            if not 0 <= index < length:
+                continue
+            for key, value in row.items():
+                column = columns.get(key)
+                if column is not None:
+                    column[index] = value
+        timestamp = [start + index * step for index in range(length)]
+        if use_numpy:
+            timestamp = numpy.array(timestamp, dtype=numpy.int64)
+            columns = {
+                key: numpy.array(column, dtype=numpy.float64)
+                for key, column in columns.items()
+            }
+        return cls(resolution, timestamp, columns)
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def __getitem__(self, key):
+        if key != "timestamp" and key not in COLUMNS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def columns(self):
+        """All energy columns as a dict"""
+        return {key: getattr(self, key) for key in COLUMNS}
+
+    def energy_wh(self):
+        """Energy in Wh per key of ENERGY_KEYS over the whole series"""
+        return sum_energy_columns(self.columns())
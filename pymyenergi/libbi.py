@@ -1,3 +1,5 @@
+import asyncio
+
 from pymyenergi.connection import Connection
 
 from . import LIBBI
@@ -78,6 +80,14 @@ STATES = {
     251: "Upgrading DSP",
     252: "Upgrading ARM",
 }
+ACTIVE_STATES = (
+    "Charging",
+    "Discharging",
+    "Duration Charging",
+    "Duration Drain",
+    "Target Charge",
+    "Boosting",
+)
 
 LIBBI_MODES = ["Stopped", "Normal", "Export"]
 LIBBI_MODE_CONFIG = {
@@ -91,6 +101,9 @@ LIBBI_MODE_CONFIG = {
 class Libbi(BaseDevice):
     """Libbi Client for myenergi API."""
 
+    ct_slots = (1, 2, 3, 4, 5, 6)
+    totals_ct_slots = ct_slots
+
     def __init__(self, connection: Connection, serialno, data={}) -> None:
         self.history_data = {}
         self._extra_data = {}
@@ -99,17 +112,21 @@ class Libbi(BaseDevice):
     async def refresh_extra(self):
         # only refresh this data if we have app credentials
         if self._connection.app_email and self._connection.app_password:
-            chargeFromGrid = await self._connection.get(
-                "/api/AccountAccess/LibbiMode?serialNo=" + str(self.serial_number),
-                oauth=True,
+            chargeFromGrid, chargeTarget = await asyncio.gather(
+                self._connection.get(
+                    "/api/AccountAccess/LibbiMode?serialNo=" + str(self.serial_number),
+                    oauth=True,
+                ),
+                self._connection.get(
+                    "/api/AccountAccess/"
+                    + str(self.serial_number)
+                    + "/LibbiChargeSetup",
+                    oauth=True,
+                ),
             )
             self._extra_data["charge_from_grid"] = chargeFromGrid["content"][
                 str(self.serial_number)
             ]
-            chargeTarget = await self._connection.get(
-                "/api/AccountAccess/" + str(self.serial_number) + "/LibbiChargeSetup",
-                oauth=True,
-            )
             self._extra_data["charge_target"] = chargeTarget["content"]["energyTarget"]
 
     @property
@@ -125,6 +142,11 @@ class Libbi(BaseDevice):
         else:
             return n
 
+    @property
+    def is_active(self):
+        """Charging or discharging"""
+        return self.status in ACTIVE_STATES
+
     @property
     def local_mode(self):
         """Get current known status"""
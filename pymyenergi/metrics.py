@@ -0,0 +1,141 @@
+#  SPDX-License-Identifier: Apache-2.0
+"""
+Request tracing and metrics for the myenergi API connection.
+
+"""
+import re
+import time
+from collections import deque
+
+_DIGITS = re.compile(r"\d")
+
+
+def endpoint_name(url):
+    """Endpoint of a request URL without serial numbers and arguments.
+
+    ``/cgi-jday-Z12345678-2023-1-1-0-0-1440`` becomes ``cgi-jday`` and
+    ``/api/AccountAccess/12345678/LibbiChargeSetup?x=1`` becomes
+    ``api/AccountAccess/{serial}/LibbiChargeSetup``.
+    """
+    path = url.split("?", 1)[0].lstrip("/")
+    if path.startswith("cgi-"):
+        parts = []
+        for part in path.split("-"):
+            # Endpoint names are lower case, serials and arguments follow
+            if not part.islower() or _DIGITS.search(part):
+                break
+            parts.append(part)
+        return "-".join(parts)
+    return "/".join(
+        "{serial}" if _DIGITS.search(part) else part for part in path.split("/")
+    )
+
+
+class RequestTrace:
+    """One HTTP request as reported to the request hooks.
+
+    ``auth`` is ``"director"`` for active server lookups, ``"digest"`` or
+    ``"oauth"``. ``challenges`` counts digest 401 round-trips made before the
+    final response. Times are in seconds.
+    """
+
+    __slots__ = (
+        "method",
+        "url",
+        "endpoint",
+        "auth",
+        "started",
+        "elapsed",
+        "decode_time",
+        "status_code",
+        "bytes",
+        "challenges",
+        "error",
+    )
+
+    def __init__(self, method, url, auth) -> None:
+        self.method = method
+        self.url = url
+        self.endpoint = endpoint_name(url)
+        self.auth = auth
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.decode_time = 0.0
+        self.status_code = None
+        self.bytes = 0
+        self.challenges = 0
+        self.error = None
+
+    @property
+    def status(self):
+        """Status code, or the exception name for failed requests"""
+        if self.status_code is not None:
+            return self.status_code
+        return type(self.error).__name__ if self.error is not None else None
+
+
+def _percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class EndpointStats:
+    """Counters and recent latencies for one endpoint, auth path and status"""
+
+    __slots__ = ("count", "bytes", "challenges", "decode_time", "latencies")
+
+    def __init__(self, samples) -> None:
+        self.count = 0
+        self.bytes = 0
+        self.challenges = 0
+        self.decode_time = 0.0
+        self.latencies = deque(maxlen=samples)
+
+    def percentile(self, q):
+        """Latency percentile (0-1) over the most recent samples, in seconds"""
+        return _percentile(self.latencies, q)
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "bytes": self.bytes,
+            "challenges": self.challenges,
+            "decode_time": self.decode_time,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
+
+
+class RequestMetrics:
+    """Per-endpoint request counters and latency percentiles.
+
+    Statistics are kept per endpoint, auth path (director, digest or oauth)
+    and status. Latency percentiles are computed over the last ``samples``
+    requests of each. Register with ``Connection(metrics=RequestMetrics())``.
+    """
+
+    def __init__(self, samples: int = 1000) -> None:
+        self.samples = samples
+        self.stats = {}
+
+    def record(self, trace):
+        """Add a finished request"""
+        key = (trace.endpoint, trace.auth, trace.status)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = EndpointStats(self.samples)
+        stats.count += 1
+        stats.bytes += trace.bytes
+        stats.challenges += trace.challenges
+        stats.decode_time += trace.decode_time
+        stats.latencies.append(trace.elapsed)
+
+    def snapshot(self):
+        """Statistics as plain dicts keyed by (endpoint, auth, status)"""
+        return {key: stats.as_dict() for key, stats in self.stats.items()}
+
+    def reset(self):
+        self.stats = {}
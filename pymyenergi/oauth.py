@@ -0,0 +1,171 @@
+#  SPDX-License-Identifier: Apache-2.0
+"""
+OAuth token handling for the myaccount.myenergi.com API.
+
+"""
+import asyncio
+import base64
+import json
+import logging
+import time
+from functools import partial
+
+from pycognito import Cognito
+
+_LOGGER = logging.getLogger(__name__)
+_USER_POOL_ID = "eu-west-2_E57cCJB20"
+_CLIENT_ID = "2fup0dhufn5vurmprjkj599041"
+
+
+def token_expiry(token):
+    """Expiry time (epoch seconds) of a JWT, or None if it can't be read"""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))["exp"]
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenManager:
+    """Keep a Cognito access token fresh without blocking the event loop.
+
+    Authentication and token renewal are blocking boto3 calls, so they run in
+    the default executor. Concurrent callers share a single in-flight
+    authentication or renewal, and once a token is obtained a background task
+    renews it ``refresh_margin`` seconds before it expires. While the current
+    token is still valid a failed renewal is logged and retried in the
+    background, waiting ``retry_delay`` seconds and doubling up to
+    ``max_retry_delay``, and requests keep using the current token.
+    """
+
+    def __init__(
+        self,
+        app_email,
+        app_password,
+        refresh_margin: float = 300,
+        cognito=None,
+        retry_delay: float = 5,
+        max_retry_delay: float = 60,
+    ) -> None:
+        self.cognito = cognito or Cognito(_USER_POOL_ID, _CLIENT_ID, username=app_email)
+        self.refresh_margin = refresh_margin
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._app_password = app_password
+        self._failures = 0
+        self._pending = None
+        self._refresh_task = None
+
+    @property
+    def access_token(self):
+        """Current access token, or None before the first authentication"""
+        return self.cognito.access_token
+
+    def _needs_update(self):
+        if not self.access_token:
+            return True
+        expiry = token_expiry(self.access_token)
+        return expiry is not None and expiry - self.refresh_margin <= time.time()
+
+    def _is_valid(self):
+        if not self.access_token:
+            return False
+        expiry = token_expiry(self.access_token)
+        return expiry is None or expiry > time.time()
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, partial(func, *args))
+
+    async def _fetch_token(self):
+        if self.cognito.refresh_token:
+            try:
+                await self._run(self.cognito.renew_access_token)
+                _LOGGER.debug("OAuth access token renewed")
+                return
+            except Exception:
+                _LOGGER.debug("OAuth token renewal failed, authenticating again")
+        await self._run(self.cognito.authenticate, self._app_password)
+        _LOGGER.debug("OAuth authenticated")
+
+    async def _update_token(self):
+        try:
+            await self._fetch_token()
+        except Exception:
+            self._schedule_retry()
+            raise
+        self._failures = 0
+        self._schedule_refresh()
+
+    def _clear_pending(self, update):
+        if self._pending is update:
+            self._pending = None
+
+    async def update(self):
+        """Authenticate or renew the token, sharing any in-flight update"""
+        update = self._pending
+        if update is None:
+            update = asyncio.ensure_future(self._update_token())
+            update.add_done_callback(self._clear_pending)
+            self._pending = update
+        await asyncio.shield(update)
+
+    def _cancel_refresh(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+    def _schedule_refresh(self):
+        self._cancel_refresh()
+        expiry = token_expiry(self.access_token)
+        if expiry is not None:
+            delay = max(expiry - self.refresh_margin - time.time(), 0)
+            self._refresh_task = asyncio.ensure_future(self._refresh_later(delay))
+
+    def _schedule_retry(self):
+        self._cancel_refresh()
+        if not self._is_valid():
+            # Nothing to fall back on, the next request tries again
+            return
+        delay = min(self.retry_delay * 2**self._failures, self.max_retry_delay)
+        self._failures += 1
+        expiry = token_expiry(self.access_token)
+        if expiry is not None:
+            delay = min(delay, max(expiry - time.time(), 0))
+        self._refresh_task = asyncio.ensure_future(self._refresh_later(delay))
+
+    async def _refresh_later(self, delay):
+        await asyncio.sleep(delay)
+        self._refresh_task = None
+        try:
+            await self.update()
+        except Exception as error:
+            _LOGGER.warning(f"Background OAuth token renewal failed: {error!r}")
+
+    async def headers(self):
+        """Authorization headers with a valid access token"""
+        if self._needs_update() and not (self._refresh_task and self._is_valid()):
+            try:
+                await self.update()
+            except Exception as error:
+                if not self._is_valid():
+                    raise
+                _LOGGER.warning(
+                    f"OAuth token renewal failed, using the current token: {error!r}"
+                )
+        return {"Authorization": f"Bearer {self.access_token}"}
+
+    async def invalidate(self, token):
+        """Renew after the server rejected ``token``, unless already renewed"""
+        if token == self.access_token:
+            await self.update()
+
+    async def close(self):
+        """Stop the background renewal and any update in flight"""
+        tasks = [task for task in (self._refresh_task, self._pending) if task]
+        self._refresh_task = None
+        self._pending = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
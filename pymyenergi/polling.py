@@ -0,0 +1,83 @@
+#  SPDX-License-Identifier: Apache-2.0
+"""
+Background polling for a MyenergiClient.
+
+"""
+import asyncio
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class Poller:
+    """Refresh a client in the background at a rate depending on device state.
+
+    Device status is refreshed every ``fast_interval`` seconds while any
+    device is active (a Zappi charging or boosting, a Libbi charging or
+    discharging) and every ``slow_interval`` seconds when all are idle.
+    Today's history is refreshed every ``history_interval`` seconds, or not
+    at all when it is None. Failed refreshes are logged and retried at the
+    slow interval.
+    """
+
+    def __init__(
+        self,
+        client,
+        fast_interval: float = 15,
+        slow_interval: float = 120,
+        history_interval: float = 900,
+    ) -> None:
+        self.client = client
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.history_interval = history_interval
+        self.last_error = None
+        self._tasks = []
+        self._first_refresh = asyncio.Event()
+
+    @property
+    def is_running(self):
+        return any(not task.done() for task in self._tasks)
+
+    def interval(self):
+        """Seconds until the next status refresh"""
+        if any(device.is_active for device in self.client.devices.values()):
+            return self.fast_interval
+        return self.slow_interval
+
+    def start(self):
+        if self.is_running:
+            return
+        self._first_refresh.clear()
+        self._tasks = [asyncio.ensure_future(self._poll_status())]
+        if self.history_interval is not None:
+            self._tasks.append(asyncio.ensure_future(self._poll_history()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _poll_status(self):
+        while True:
+            interval = self.slow_interval
+            try:
+                await self.client.refresh()
+                interval = self.interval()
+            except Exception as error:
+                self.last_error = error
+                _LOGGER.warning(f"Polling refresh failed: {error}")
+            self._first_refresh.set()
+            await asyncio.sleep(interval)
+
+    async def _poll_history(self):
+        # History needs the device list from the first status refresh
+        await self._first_refresh.wait()
+        while True:
+            try:
+                await self.client.refresh_history_today()
+            except Exception as error:
+                self.last_error = error
+                _LOGGER.warning(f"Polling history refresh failed: {error}")
+            await asyncio.sleep(self.history_interval)
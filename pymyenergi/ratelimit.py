@@ -0,0 +1,64 @@
+#  SPDX-License-Identifier: Apache-2.0
+"""
+Client side rate limiting for requests to the myenergi API.
+
+"""
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Token bucket allowing ``burst`` requests at once and ``rate`` per second"""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Take a token, waiting in line until one is available"""
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class RateLimiter:
+    """Token buckets keyed per hub and host.
+
+    Every hub gets its own bucket for each host it talks to, so status polling
+    on the ASN server and OAuth calls to myaccount.myenergi.com are limited
+    independently. ``host_rates`` overrides ``rate`` and ``burst`` for
+    specific hosts, e.g. ``{"myaccount.myenergi.com": (0.5, 2)}``. A limiter
+    can be shared by several connections to the same hub. Requests over the
+    limit wait in a queue rather than fail.
+    """
+
+    def __init__(self, rate: float = 2.0, burst: int = 5, host_rates=None) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.host_rates = host_rates or {}
+        self._buckets = {}
+
+    def bucket(self, hub, host):
+        """Token bucket for a hub and host"""
+        key = (str(hub), host)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            rate, burst = self.host_rates.get(host, (self.rate, self.burst))
+            bucket = TokenBucket(rate, burst)
+            self._buckets[key] = bucket
+        return bucket
+
+    async def acquire(self, hub, host):
+        """Wait until a request from hub to host is allowed"""
+        await self.bucket(hub, host).acquire()
@@ -0,0 +1,118 @@
+#  SPDX-License-Identifier: Apache-2.0
+"""
+Retry policy for requests to the myenergi API.
+
+"""
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+from .exceptions import MyenergiException
+from .exceptions import TimeoutException
+from .exceptions import WrongCredentials
+
+# Digest API endpoints that only read data. Every other cgi endpoint changes
+# device settings (modes, boosts, priorities, locks) and is not blindly repeated.
+READ_ENDPOINTS = (
+    "/cgi-jstatus-",
+    "/cgi-jday-",
+    "/cgi-jdayhour-",
+    "/cgi-get-app-key-",
+    "/cgi-boost-time-",
+)
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE")
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header value, or None"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Decide if and when a failed request is retried.
+
+    Requests rejected before reaching the device (429 or connection
+    failures) are always retried. Other transient failures - timeouts and the
+    ``retry_statuses`` - are only retried for idempotent requests. Delays grow
+    exponentially from ``backoff_base`` up to ``backoff_max`` with full
+    jitter, unless the server sent a ``Retry-After`` header.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        retry_statuses=(429, 500, 502, 503, 504),
+        retry_timeouts: bool = True,
+    ) -> None:
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = set(retry_statuses)
+        self.retry_timeouts = retry_timeouts
+
+    def is_idempotent(self, method, url, oauth=False):
+        """Can the request be repeated without side effects?"""
+        if method.upper() not in IDEMPOTENT_METHODS:
+            return False
+        if oauth:
+            return True
+        return method.upper() == "GET" and url.startswith(READ_ENDPOINTS)
+
+    def is_retryable(self, error, method, url, oauth=False):
+        """Is the error transient, and is the request safe to send again?"""
+        if isinstance(error, WrongCredentials):
+            return False
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)):
+            return True
+        if isinstance(error, TimeoutException):
+            code = getattr(error, "code", None)
+            if code in ("CONNECT_TIMEOUT", "POOL_TIMEOUT"):
+                # The request never reached the server
+                return True
+            if code == "DEADLINE_EXCEEDED" or not self.retry_timeouts:
+                return False
+        elif isinstance(error, httpx.TransportError):
+            # Like a read timeout the request may have reached the server
+            pass
+        elif isinstance(error, MyenergiException) and getattr(error, "code", None):
+            if error.code == 429:
+                return True
+            if error.code not in self.retry_statuses:
+                return False
+        else:
+            return False
+        return self.is_idempotent(method, url, oauth)
+
+    def backoff(self, attempt, error=None):
+        """Seconds to wait before retry number ``attempt`` (starting at 1)"""
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.backoff_base)
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+        )
+
+    def delay(self, attempt, error, method, url, oauth=False):
+        """Seconds to wait before retrying, or None to give up"""
+        if attempt >= self.max_attempts:
+            return None
+        if not self.is_retryable(error, method, url, oauth):
+            return None
+        delay = self.backoff(attempt, error)
+        if delay > self.backoff_max + self.backoff_base:
+            # The server asked us to back off longer than we are willing to wait
+            return None
+        return delay
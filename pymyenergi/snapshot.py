@@ -0,0 +1,40 @@
+#  SPDX-License-Identifier: Apache-2.0
+"""
+Snapshots of MyenergiClient state for warm starts.
+
+"""
+import json
+import os
+import tempfile
+
+from .decoder import get_decoder
+
+SNAPSHOT_VERSION = 1
+
+
+def write_snapshot(path, snapshot):
+    """Write a snapshot dict as compact JSON, replacing path atomically"""
+    path = os.path.expanduser(path)
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+    try:
+        with os.fdopen(fd, "w") as snapshot_file:
+            json.dump(
+                {"version": SNAPSHOT_VERSION, **snapshot},
+                snapshot_file,
+                separators=(",", ":"),
+            )
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_snapshot(path, decoder=None):
+    """Read a snapshot dict, raises ValueError for unsupported snapshots"""
+    with open(os.path.expanduser(path), "rb") as snapshot_file:
+        snapshot = get_decoder(decoder)(snapshot_file.read())
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot {path}")
+    return snapshot
@@ -0,0 +1,254 @@
+#  SPDX-License-Identifier: Apache-2.0
+"""
+Local stand-in for the myenergi servers, for tests and benchmarks.
+
+``FakeMyenergiServer`` is an httpx transport handler implementing the
+director lookup with its ``X_MYENERGI-asn`` header, digest authentication,
+device status, history (``cgi-jday`` and ``cgi-jdayhour``), control commands
+and the OAuth ``/api/...`` endpoints used by this library, without any
+network access::
+
+    server = FakeMyenergiServer.from_fixtures("tests/fixtures", latency=0.05)
+    conn = Connection("12345678", "password", asyncClient=server.client())
+
+Latency, random server errors and rate limiting (429) can be configured.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import secrets
+import time
+from urllib.request import parse_http_list
+
+import httpx
+
+DIRECTOR_HOST = "director.myenergi.net"
+OAUTH_HOST = "myaccount.myenergi.com"
+PREFIXES = {"Z": "zappi", "E": "eddi", "H": "harvi", "L": "libbi"}
+
+_JSTATUS = re.compile(r"^/cgi-jstatus-(?:\*|E|([ZEHL])(\d+))$")
+_HISTORY = re.compile(r"^/cgi-(jday|jdayhour)-[ZEHL](\d+)-")
+_BOOST_TIME = re.compile(r"^/cgi-boost-time-Z(\d+)$")
+_CHARGE_SETUP = re.compile(r"^/api/AccountAccess/(\d+)/LibbiChargeSetup$")
+_TARGET_ENERGY = re.compile(r"^/api/AccountAccess/(\d+)/TargetEnergy$")
+
+
+def _md5(value):
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+class FakeMyenergiServer:
+    """Fake myenergi director, active server and myaccount API.
+
+    ``devices`` and ``keys`` are the ``/cgi-jstatus-*`` and
+    ``/cgi-get-app-key-`` payloads, ``minute_history`` and ``hour_history``
+    lists of rows returned for any device by ``cgi-jday`` and
+    ``cgi-jdayhour``. Every request waits ``latency`` seconds, fails with a
+    503 with probability ``error_rate``, and gets a 429 once more than
+    ``rate_limit`` requests per second arrive. ``fail_next()`` queues
+    specific failures. All requests are recorded in ``requests``.
+    """
+
+    def __init__(
+        self,
+        devices=None,
+        keys=None,
+        minute_history=None,
+        hour_history=None,
+        username=None,
+        password=None,
+        asn="s18.myenergi.net",
+        latency: float = 0,
+        error_rate: float = 0,
+        rate_limit: float = None,
+        seed=None,
+    ) -> None:
+        self.devices = devices or []
+        self.keys = keys or {}
+        self.minute_history = minute_history or []
+        self.hour_history = hour_history or []
+        self.username = username
+        self.password = password
+        self.asn = asn
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self.nonce = secrets.token_hex(8)
+        self.requests = []
+        self.libbi_settings = {}
+        self._failures = []
+        self._recent = []
+
+    @classmethod
+    def from_fixtures(cls, directory, client="client", **kwargs):
+        """Server serving the JSON fixtures in directory"""
+
+        def load(name):
+            with open(os.path.join(directory, f"{name}.json")) as fixture:
+                return json.load(fixture)
+
+        data = load(client)
+        minute_history = next(iter(load("jday").values()))
+        hour_history = next(iter(load("jdayhour").values()))
+        return cls(
+            data["devices"], data["keys"], minute_history, hour_history, **kwargs
+        )
+
+    def transport(self):
+        """httpx transport answering from this server"""
+        return httpx.MockTransport(self)
+
+    def client(self, **kwargs):
+        """httpx.AsyncClient connected to this server"""
+        return httpx.AsyncClient(transport=self.transport(), **kwargs)
+
+    def fail_next(self, status: int = 503, count: int = 1, retry_after=None):
+        """Answer the next count requests with status"""
+        self._failures.extend([(status, retry_after)] * count)
+
+    def clear_failures(self):
+        """Drop failures queued by fail_next"""
+        self._failures.clear()
+
+    def count(self, path_prefix, host=None):
+        """Number of requests received for a path prefix"""
+        return sum(
+            1
+            for method, request_host, path in self.requests
+            if path.startswith(path_prefix) and (host is None or host == request_host)
+        )
+
+    def _headers(self):
+        return {"X_MYENERGI-asn": self.asn}
+
+    def _json(self, data, status=200):
+        return httpx.Response(status, json=data, headers=self._headers())
+
+    def _error(self, status, retry_after=None):
+        headers = self._headers()
+        if retry_after is not None:
+            headers["Retry-After"] = str(retry_after)
+        return httpx.Response(status, headers=headers)
+
+    def _rate_limited(self):
+        if self.rate_limit is None:
+            return False
+        now = time.monotonic()
+        self._recent = [t for t in self._recent if now - t < 1]
+        self._recent.append(now)
+        return len(self._recent) > self.rate_limit
+
+    def _challenge(self):
+        return httpx.Response(
+            401,
+            headers={
+                "WWW-Authenticate": f'Digest realm="MEHUB", nonce="{self.nonce}", qop="auth", algorithm="MD5"'
+            },
+        )
+
+    def _digest_valid(self, request):
+        authorization = request.headers.get("Authorization", "")
+        if not authorization.lower().startswith("digest "):
+            return False
+        fields = {}
+        for field in parse_http_list(authorization[7:]):
+            key, _, value = field.strip().partition("=")
+            fields[key] = value.strip('"')
+        if fields.get("nonce") != self.nonce:
+            return False
+        if self.username is not None and fields.get("username") != str(self.username):
+            return False
+        if self.password is None:
+            return True
+        ha1 = _md5(f"{fields.get('username')}:{fields.get('realm')}:{self.password}")
+        ha2 = _md5(f"{request.method}:{fields.get('uri')}")
+        expected = _md5(
+            f"{ha1}:{self.nonce}:{fields.get('nc')}:{fields.get('cnonce')}:{fields.get('qop')}:{ha2}"
+        )
+        return fields.get("response") == expected
+
+    def _device(self, kind, serial):
+        for group in self.devices:
+            for device in group.get(kind, []):
+                if str(device.get("sno")) == serial:
+                    return device
+        return None
+
+    def _digest_endpoint(self, request):
+        path = request.url.raw_path.decode()
+        match = _JSTATUS.match(path)
+        if match:
+            if match.group(1) is None:
+                return self._json(self.devices)
+            kind = PREFIXES[match.group(1)]
+            device = self._device(kind, match.group(2))
+            return self._json({kind: [device]} if device else {})
+        if path == "/cgi-get-app-key-":
+            return self._json(self.keys)
+        match = _HISTORY.match(path)
+        if match:
+            rows = (
+                self.minute_history if match.group(1) == "jday" else self.hour_history
+            )
+            return self._json({f"U{match.group(2)}": rows})
+        if _BOOST_TIME.match(path):
+            return self._json({"boost_times": []})
+        if path.startswith("/cgi-"):
+            # Control commands
+            return self._json({"status": 0, "statustext": ""})
+        return self._error(404)
+
+    def _oauth_endpoint(self, request):
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return httpx.Response(401)
+        path = request.url.path
+        serial = request.url.params.get("serialNo")
+        if path == "/api/Location":
+            return self._json({"content": [{"isGuestLocation": False}]})
+        if path == "/api/AccountAccess/LibbiMode":
+            settings = self.libbi_settings.setdefault(str(serial), {})
+            if request.method == "PUT":
+                value = request.url.params.get("chargeFromGrid") == "True"
+                settings["charge_from_grid"] = value
+                return self._json({"status": True})
+            return self._json(
+                {"content": {str(serial): settings.get("charge_from_grid", True)}}
+            )
+        match = _CHARGE_SETUP.match(path)
+        if match:
+            settings = self.libbi_settings.setdefault(match.group(1), {})
+            return self._json(
+                {"content": {"energyTarget": settings.get("charge_target", 5520)}}
+            )
+        match = _TARGET_ENERGY.match(path)
+        if match and request.method == "PUT":
+            settings = self.libbi_settings.setdefault(match.group(1), {})
+            settings["charge_target"] = int(
+                float(request.url.params.get("targetEnergy", 0))
+            )
+            return self._json({"status": True})
+        return self._error(404)
+
+    async def __call__(self, request):
+        self.requests.append(
+            (request.method, request.url.host, request.url.raw_path.decode())
+        )
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._failures:
+            return self._error(*self._failures.pop(0))
+        if self._rate_limited():
+            return self._error(429, retry_after=1)
+        if self.error_rate and self.random.random() < self.error_rate:
+            return self._error(503)
+        if request.url.host == OAUTH_HOST:
+            return self._oauth_endpoint(request)
+        if not self._digest_valid(request):
+            return self._challenge()
+        if request.url.host == DIRECTOR_HOST:
+            return self._json({})
+        return self._digest_endpoint(request)
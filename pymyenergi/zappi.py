@@ -5,6 +5,7 @@ from .base_device import BaseDevice
 
 CHARGE_MODES = ["None", "Fast", "Eco", "Eco+", "Stopped"]
 STATES = ["Unkn0", "Paused", "Unkn2", "Charging", "Boosting", "Completed"]
+ACTIVE_STATES = ("Charging", "Boosting")
 PLUG_STATES = {
     "A": "EV Disconnected",
     "B1": "EV Connected",
@@ -34,6 +35,9 @@ PHASE_SETTING = {
 class Zappi(BaseDevice):
     """Zappi Client for myenergi API."""
 
+    ct_slots = (1, 2, 3, 4, 5, 6)
+    totals_ct_slots = ct_slots
+
     def __init__(self, connection: Connection, serialno, data=None) -> None:
         self.history_data = {}
         self.boost_data = {}
@@ -131,6 +135,11 @@ class Zappi(BaseDevice):
         """Current status, one of Paused, Charging or Completed"""
         return STATES[self._data.get("sta", 1)]
 
+    @property
+    def is_active(self):
+        """Charging or boosting"""
+        return self.status in ACTIVE_STATES
+
     @property
     def plug_status(self):
         """Plug status, one of EV Disconnected, EV Connected, Waiting for EV, EV Ready to charge, Charging or Fault"""
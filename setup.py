@@ -21,6 +21,7 @@ setup(
     packages=["pymyenergi"],
     python_requires=">=3.6",
     install_requires=["httpx", "pycognito"],
+    extras_require={"fast": ["orjson", "numpy"]},
     classifiers=[
         "License :: OSI Approved :: MIT License",
         "Programming Language :: Python",
@@ -0,0 +1,69 @@
+import httpx
+import pytest
+
+from pymyenergi.auth import PreemptiveDigestAuth
+
+pytestmark = pytest.mark.asyncio
+
+
+class DigestServer:
+    """Minimal digest server that only accepts its current nonce"""
+
+    def __init__(self):
+        self.nonce = "nonce-1"
+        self.requests = []
+
+    def challenge(self):
+        return httpx.Response(
+            401,
+            headers={
+                "WWW-Authenticate": f'Digest realm="MEHUB", nonce="{self.nonce}", qop="auth"'
+            },
+        )
+
+    def __call__(self, request):
+        self.requests.append(request)
+        authorization = request.headers.get("Authorization", "")
+        if f'nonce="{self.nonce}"' not in authorization:
+            return self.challenge()
+        return httpx.Response(200, json={})
+
+
+async def test_challenge_reused_for_later_requests():
+    server = DigestServer()
+    auth = PreemptiveDigestAuth("12345678", "password")
+    async with httpx.AsyncClient(transport=httpx.MockTransport(server)) as client:
+        for _ in range(3):
+            response = await client.get(
+                "https://s18.myenergi.net/cgi-jstatus-*", auth=auth
+            )
+            assert response.status_code == 200
+    assert len(server.requests) == 4
+    nonce_counts = [
+        r.headers["Authorization"].split("nc=")[1][:8] for r in server.requests[1:]
+    ]
+    assert nonce_counts == ["00000001", "00000002", "00000003"]
+
+
+async def test_stale_nonce_rechallenged():
+    server = DigestServer()
+    auth = PreemptiveDigestAuth("12345678", "password")
+    async with httpx.AsyncClient(transport=httpx.MockTransport(server)) as client:
+        await client.get("https://s18.myenergi.net/cgi-jstatus-*", auth=auth)
+        server.nonce = "nonce-2"
+        server.requests.clear()
+        response = await client.get("https://s18.myenergi.net/cgi-jstatus-*", auth=auth)
+    assert response.status_code == 200
+    assert len(server.requests) == 2
+
+
+async def test_challenges_kept_per_host():
+    server = DigestServer()
+    auth = PreemptiveDigestAuth("12345678", "password")
+    async with httpx.AsyncClient(transport=httpx.MockTransport(server)) as client:
+        await client.get("https://director.myenergi.net/cgi-jstatus-E", auth=auth)
+        await client.get("https://s18.myenergi.net/cgi-jstatus-*", auth=auth)
+        server.requests.clear()
+        await client.get("https://director.myenergi.net/cgi-jstatus-E", auth=auth)
+        await client.get("https://s18.myenergi.net/cgi-jstatus-*", auth=auth)
+    assert len(server.requests) == 2
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+
+from pymyenergi.breaker import CircuitBreaker
+from pymyenergi.breaker import CircuitBreakers
+from pymyenergi.connection import Connection
+from pymyenergi.exceptions import CircuitOpenException
+from pymyenergi.exceptions import MyenergiException
+from pymyenergi.testing import FakeMyenergiServer
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_breaker_states():
+    breaker = CircuitBreaker(
+        "s18.myenergi.net", failure_threshold=2, reset_timeout=0.02
+    )
+    breaker.record_failure()
+    breaker.before_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenException):
+        breaker.before_request()
+    await asyncio.sleep(0.02)
+    assert breaker.state == "half_open"
+    breaker.before_request()
+    with pytest.raises(CircuitOpenException):
+        # Only one probe at a time
+        breaker.before_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    await asyncio.sleep(0.02)
+    breaker.before_request()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+async def test_connection_fails_fast_while_open():
+    server = FakeMyenergiServer.from_fixtures("tests/fixtures")
+    breakers = CircuitBreakers(failure_threshold=3, reset_timeout=0.05)
+    conn = Connection(
+        "12345678", "password", asyncClient=server.client(), circuit_breakers=breakers
+    )
+    await conn.get("/cgi-jstatus-*")
+    server.fail_next(503, count=100)
+    for _ in range(3):
+        with pytest.raises(MyenergiException):
+            await conn.get("/cgi-jstatus-*")
+    sent = len(server.requests)
+    with pytest.raises(CircuitOpenException) as error:
+        await conn.get("/cgi-jstatus-*")
+    assert error.value.host == "s18.myenergi.net"
+    # No director lookup or request was sent
+    assert len(server.requests) == sent
+
+    server.clear_failures()
+    await asyncio.sleep(0.05)
+    assert len(await conn.get("/cgi-jstatus-*")) == 5
+    assert breakers.get("s18.myenergi.net").state == "closed"
@@ -0,0 +1,88 @@
+import httpx
+import pytest
+
+from pymyenergi.cache import MISSING
+from pymyenergi.cache import ResponseCache
+from pymyenergi.client import MyenergiClient
+from pymyenergi.connection import Connection
+
+pytestmark = pytest.mark.asyncio
+
+
+def counting_connection(response_cache):
+    requests = []
+
+    def handler(request):
+        requests.append(request.url.path)
+        return httpx.Response(
+            200,
+            json={"path": request.url.path},
+            headers={"X_MYENERGI-asn": "s18.myenergi.net"},
+        )
+
+    conn = Connection(
+        "12345678",
+        "password",
+        asyncClient=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        response_cache=response_cache,
+    )
+    return conn, requests
+
+
+async def test_only_configured_endpoints_cached():
+    conn, requests = counting_connection(ResponseCache())
+    for _ in range(2):
+        await conn.get("/cgi-get-app-key-")
+        await conn.get("/cgi-boost-time-Z12345678")
+        await conn.get("/cgi-jstatus-*")
+    assert requests.count("/cgi-get-app-key-") == 1
+    assert requests.count("/cgi-boost-time-Z12345678") == 1
+    assert requests.count("/cgi-jstatus-*") == 2
+
+
+async def test_write_invalidates_related_endpoint():
+    conn, requests = counting_connection(ResponseCache())
+    await conn.get("/cgi-boost-time-Z12345678")
+    await conn.get("/cgi-zappi-mode-Z12345678-0-11-10-0700")
+    await conn.get("/cgi-boost-time-Z12345678")
+    assert requests.count("/cgi-boost-time-Z12345678") == 2
+
+
+async def test_entries_expire():
+    cache = ResponseCache(ttls={r"^/cgi-get-app-key-$": 0})
+    conn, requests = counting_connection(cache)
+    await conn.get("/cgi-get-app-key-")
+    await conn.get("/cgi-get-app-key-")
+    assert len(requests) == 3
+
+
+async def test_lru_eviction_and_hub_keys():
+    cache = ResponseCache(ttls={".*": 60}, max_entries=2)
+    cache.store("1", "GET", "/a", False, "a")
+    cache.store("1", "GET", "/b", False, "b")
+    assert cache.get("1", "/a") == "a"
+    cache.store("1", "GET", "/c", False, "c")
+    assert len(cache) == 2
+    assert cache.get("1", "/b") is MISSING
+    assert cache.get("1", "/a") == "a"
+    assert cache.get("2", "/a") is MISSING
+
+
+async def test_charge_target_invalidates_charge_setup():
+    cache = ResponseCache()
+    url = "/api/AccountAccess/12345678/LibbiChargeSetup"
+    cache.store("1", "GET", url, True, {"content": {"energyTarget": 5000}})
+    cache.store(
+        "1", "PUT", "/api/AccountAccess/12345678/TargetEnergy?targetEnergy=1", True, {}
+    )
+    assert cache.get("1", url, True) is MISSING
+
+
+async def test_client_bypasses_cached_keys_for_unknown_serial():
+    conn, requests = counting_connection(ResponseCache())
+    client = MyenergiClient(conn)
+    client._keys = {"H1": []}
+    client.invalidate_keys()
+    await conn.get("/cgi-get-app-key-")
+    await client.fetch_data()
+    assert requests.count("/cgi-get-app-key-") == 2
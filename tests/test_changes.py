@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from pymyenergi.changes import diff_data
+from pymyenergi.client import MyenergiClient
+from pymyenergi.connection import Connection
+from pymyenergi.testing import FakeMyenergiServer
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_diff_data():
+    old = {"sta": 1, "grd": 100, "che": 0.0}
+    new = {"sta": 3, "grd": 100, "div": 1400}
+    assert diff_data(old, new) == {
+        "sta": (1, 3),
+        "div": (None, 1400),
+        "che": (0.0, None),
+    }
+    assert diff_data(old, dict(old)) == {}
+
+
+def site():
+    server = FakeMyenergiServer.from_fixtures("tests/fixtures")
+    conn = Connection("12345678", "password", asyncClient=server.client())
+    zappi = next(group["zappi"][0] for group in server.devices if "zappi" in group)
+    return server, MyenergiClient(conn), zappi
+
+
+async def test_change_callbacks():
+    server, client, zappi = site()
+    changes = []
+    client.on_change(changes.append)
+    await client.refresh()
+    assert len(changes) == 6
+    assert all(change.added for change in changes)
+
+    changes.clear()
+    await client.refresh()
+    assert changes == []
+
+    zappi["sta"] = 3
+    zappi["div"] = 7200
+    await client.refresh()
+    assert len(changes) == 1
+    change = changes[0]
+    assert change.serial_number == zappi["sno"]
+    assert change.changes == {"sta": (1, 3), "div": (None, 7200)}
+    assert "sta" in change
+    # Callbacks run once the client state is updated
+    assert change.device.status == "Charging"
+
+    client.remove_change_callback(changes.append)
+    zappi["sta"] = 1
+    await client.refresh()
+    assert len(changes) == 1
+
+
+async def test_changes_iterator():
+    server, client, zappi = site()
+    await client.refresh()
+    stream = client.changes()
+    received = []
+
+    async def consume():
+        async for change in stream:
+            received.append(change)
+
+    consumer = asyncio.ensure_future(consume())
+    zappi["grd"] = 5000
+    await client.refresh()
+    zappi["grd"] = 6000
+    await client.refresh()
+    stream.close()
+    await asyncio.wait_for(consumer, 1)
+    assert [change.changes["grd"] for change in received] == [
+        (7253, 5000),
+        (5000, 6000),
+    ]
+    assert client._change_streams == []
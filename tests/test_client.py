@@ -1,13 +1,21 @@
+import asyncio
+from functools import partial
 from unittest.mock import MagicMock
+from unittest.mock import patch
 
+import httpx
 import pytest
 
 from pymyenergi.client import MyenergiClient
+from pymyenergi.connection import Connection
 from pymyenergi.eddi import Eddi
 from pymyenergi.harvi import Harvi
 from pymyenergi.libbi import Libbi
+from pymyenergi.testing import FakeMyenergiServer
 from pymyenergi.zappi import Zappi
 
+from .conftest import load_fixture_json
+
 # All test coroutines will be treated as marked.
 pytestmark = pytest.mark.asyncio
 
@@ -104,3 +112,253 @@ async def test_get_libbi_devices(client_fetch_data_fixture):
     devices = await client.get_devices("libbi")
     assert len(devices) == 1
     assert isinstance(devices[0], Libbi)
+
+
+class SlowOAuthConnection(MockConnection):
+    """Mock connection tracking how many requests run at the same time"""
+
+    def __init__(self, app_password, app_email) -> None:
+        super().__init__(app_password, app_email)
+        self.active = 0
+        self.max_active = 0
+
+    async def send(self, method, url, json=None, oauth=False):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        serial = url.split("serialNo=")[-1].split("/")[-2 if "Setup" in url else -1]
+        return {"content": {serial: True, "energyTarget": 5000}}
+
+
+def libbi_site(count):
+    libbi = load_fixture_json("libbi")
+    libbis = [dict(libbi, sno=24047164 + i) for i in range(count)]
+    return {"devices": [{"libbi": libbis}], "keys": {"H1234": []}}
+
+
+async def test_libbi_extra_refreshed_concurrently():
+    slow_conn = SlowOAuthConnection("test@test.com", "1234")
+    client = MyenergiClient(slow_conn, max_concurrency=2)
+    with patch.object(client, "fetch_data", return_value=libbi_site(3)):
+        await client.refresh()
+    # Two libbis at a time, each with two OAuth calls in parallel
+    assert slow_conn.max_active == 4
+    libbis = client.get_devices_sync("libbi")
+    assert all(libbi.charge_target == 5 for libbi in libbis)
+    assert all(libbi.charge_from_grid for libbi in libbis)
+
+
+async def test_gather_limited_cancelled():
+    client = MyenergiClient(conn, max_concurrency=1)
+    started = []
+
+    async def slow(index):
+        started.append(index)
+        await asyncio.sleep(1)
+
+    task = asyncio.ensure_future(
+        client._gather_limited([partial(slow, index) for index in range(3)])
+    )
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    # Queued calls are never started, so no coroutine is left unawaited
+    assert started == [0]
+
+
+async def test_gather_limited_failure_cancels_others():
+    client = MyenergiClient(conn, max_concurrency=2)
+    started = []
+    cancelled = []
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError()
+
+    async def slow():
+        started.append(True)
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    with pytest.raises(ValueError):
+        await client._gather_limited([fail, slow, slow])
+    # Nothing is left running in the background
+    assert cancelled and cancelled == started
+
+
+async def test_gather_limited_shares_limit():
+    client = MyenergiClient(conn, max_concurrency=2)
+    active = 0
+    peak = 0
+
+    async def work():
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+
+    await asyncio.gather(
+        client._gather_limited([work] * 3), client._gather_limited([work] * 3)
+    )
+    assert peak == 2
+
+
+async def test_history_refreshed_concurrently():
+    server = FakeMyenergiServer.from_fixtures("tests/fixtures", latency=0.01)
+    active = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        try:
+            return await server(request)
+        finally:
+            active -= 1
+
+    transport = httpx.MockTransport(handler)
+    conn = Connection(
+        "12345678", "password", asyncClient=httpx.AsyncClient(transport=transport)
+    )
+    client = MyenergiClient(conn, max_concurrency=2)
+    await client.refresh()
+    peak = 0
+    await client.refresh_history_today()
+    assert peak == 2
+    assert server.count("/cgi-jdayhour-") == 4
+
+    peak = 0
+    out = await client.show()
+    # The status request overlaps at most max_concurrency history requests
+    assert peak == 3
+    assert "Energy imported" in out
+    await conn.close()
+
+
+def totals_from_ct_properties(client):
+    totals = {}
+    for device in client.get_devices_sync():
+        slots = {"eddi": 2, "harvi": 3}.get(device.kind, 6)
+        for slot in range(1, slots + 1):
+            ct = getattr(device, f"ct{slot}")
+            if ct.is_assigned:
+                totals[ct.name] = totals.get(ct.name, 0) + ct.power
+    return totals
+
+
+async def test_ct_index_follows_assignments():
+    server = FakeMyenergiServer.from_fixtures("tests/fixtures")
+    conn = Connection("12345678", "password", asyncClient=server.client())
+    client = MyenergiClient(conn)
+    await client.refresh()
+    totals = client.get_power_totals()
+    for name, power in totals_from_ct_properties(client).items():
+        assert totals[name] == power
+    index = client._ct_index
+
+    harvi = next(group["harvi"][0] for group in server.devices if "harvi" in group)
+    harvi["ectp1"] = 1234
+    await client.refresh()
+    # Same assignments, the index is reused
+    assert client._ct_index is index
+
+    harvi["ectt1"] = "Grid"
+    await client.refresh()
+    assert client._ct_index is not index
+    totals = client.get_power_totals()
+    for name, power in totals_from_ct_properties(client).items():
+        assert totals[name] == power
+    assert client.power_grid == totals_from_ct_properties(client)["Grid"]
+    await conn.close()
+
+
+async def test_key_and_kind_indexes(client_fetch_data_fixture):
+    client = MyenergiClient(conn)
+    await client.refresh()
+    assert client.find_device_name("siteName", None) == "Test Site"
+    assert client.find_device_name("missing", "default") == "default"
+    names = {device.name for device in client.get_devices_sync()}
+    assert len(names) == 6
+    zappis = client.get_devices_sync("zappi")
+    assert [zappi.kind for zappi in zappis] == ["zappi", "zappi"]
+    # Callers get their own list
+    zappis.clear()
+    assert len(client.get_devices_sync("zappi")) == 2
+    assert client.get_devices_sync("unknown") == []
+
+
+async def test_keys_refetched_for_unknown_serial():
+    server = FakeMyenergiServer.from_fixtures("tests/fixtures")
+    conn = Connection("12345678", "password", asyncClient=server.client())
+    client = MyenergiClient(conn)
+    await client.refresh()
+    keys_requests = server.count("/cgi-get-app-key-")
+    await client.refresh()
+    assert server.count("/cgi-get-app-key-") == keys_requests
+
+    zappi = next(group["zappi"][0] for group in server.devices if "zappi" in group)
+    server.devices.append({"zappi": [dict(zappi, sno=19000000)]})
+    await client.refresh()
+    new_zappi = client.devices[19000000]
+    assert new_zappi.name == "zappi-19000000"
+
+    server.keys["H1234"].append({"key": "Z19000000", "val": "Garage"})
+    next(iter(server.keys.values()))[0]["val"] = "Renamed Eddi"
+    await client.refresh()
+    assert server.count("/cgi-get-app-key-") == keys_requests + 1
+    assert new_zappi.name == "Garage"
+    assert client.get_devices_sync("eddi")[0].name == "Renamed Eddi"
+
+    # Each unknown serial only triggers one refetch
+    server.devices.append({"zappi": [dict(zappi, sno=19000001)]})
+    await client.refresh()
+    await client.refresh()
+    await client.refresh()
+    assert server.count("/cgi-get-app-key-") == keys_requests + 2
+    await conn.close()
+
+
+async def test_keys_ttl():
+    server = FakeMyenergiServer.from_fixtures("tests/fixtures")
+    conn = Connection("12345678", "password", asyncClient=server.client())
+    client = MyenergiClient(conn, keys_ttl=0)
+    await client.refresh()
+    keys_requests = server.count("/cgi-get-app-key-")
+    await client.refresh()
+    assert server.count("/cgi-get-app-key-") == keys_requests + 1
+    await conn.close()
+
+
+async def test_failed_keys_refetch_keeps_old_keys():
+    server = FakeMyenergiServer.from_fixtures("tests/fixtures")
+
+    async def handler(request):
+        if failing and request.url.path == "/cgi-get-app-key-":
+            return httpx.Response(503)
+        return await server(request)
+
+    failing = False
+    conn = Connection(
+        "12345678",
+        "password",
+        asyncClient=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    client = MyenergiClient(conn, keys_ttl=0)
+    await client.refresh()
+    names = [device.name for device in client.get_devices_sync()]
+    failing = True
+    await client.refresh()
+    assert [device.name for device in client.get_devices_sync()] == names
+    assert client._keys_stale()
+    failing = False
+    keys_requests = server.count("/cgi-get-app-key-")
+    await client.refresh()
+    assert server.count("/cgi-get-app-key-") == keys_requests + 1
+    await conn.close()
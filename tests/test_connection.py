@@ -0,0 +1,215 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from pymyenergi.asn_cache import AsnCache
+from pymyenergi.client import MyenergiClient
+from pymyenergi.connection import Connection
+from pymyenergi.connection import request_deadline
+from pymyenergi.exceptions import MyenergiException
+from pymyenergi.exceptions import TimeoutException
+from pymyenergi.testing import FakeMyenergiServer
+
+pytestmark = pytest.mark.asyncio
+
+
+def mock_client(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+async def test_owned_client_closed_by_context_manager():
+    async with Connection("12345678", "password") as conn:
+        assert not conn.is_closed
+    assert conn.is_closed
+
+
+async def test_shared_client_left_open():
+    shared = mock_client(lambda request: httpx.Response(200, json={}))
+    conn_1 = Connection("12345678", "password", asyncClient=shared)
+    conn_2 = Connection("87654321", "password", asyncClient=shared)
+    assert conn_1.asyncClient is conn_2.asyncClient
+    await conn_1.close()
+    assert not shared.is_closed
+    await shared.aclose()
+
+
+async def test_connections_do_not_share_default_client():
+    async with Connection("12345678", "password") as conn_1:
+        async with Connection("87654321", "password") as conn_2:
+            assert conn_1.asyncClient is not conn_2.asyncClient
+
+
+def director_handler(calls):
+    def handler(request):
+        calls.append(request.url.host)
+        return httpx.Response(
+            200, json={}, headers={"X_MYENERGI-asn": "s18.myenergi.net"}
+        )
+
+    return handler
+
+
+async def test_asn_cache_skips_director(tmp_path):
+    cache_path = str(tmp_path / "asn.json")
+    calls = []
+    async with Connection(
+        "12345678",
+        "password",
+        asyncClient=mock_client(director_handler(calls)),
+        asn_cache=cache_path,
+    ) as conn:
+        await conn.get("/cgi-jstatus-*")
+    assert calls == ["director.myenergi.net", "s18.myenergi.net"]
+
+    calls.clear()
+    conn = Connection(
+        "12345678",
+        "password",
+        asyncClient=mock_client(director_handler(calls)),
+        asn_cache=cache_path,
+    )
+    assert conn.base_url == "https://s18.myenergi.net"
+    await conn.get("/cgi-jstatus-*")
+    assert calls == ["s18.myenergi.net"]
+
+
+async def test_asn_cache_invalidated_on_server_error(tmp_path):
+    cache = AsnCache(str(tmp_path / "asn.json"))
+    cache.set("12345678", "s18.myenergi.net")
+    conn = Connection(
+        "12345678",
+        "password",
+        asyncClient=mock_client(
+            lambda request: httpx.Response(
+                503, headers={"X_MYENERGI-asn": "s18.myenergi.net"}
+            )
+        ),
+        asn_cache=cache,
+    )
+    with pytest.raises(MyenergiException):
+        await conn.get("/cgi-jstatus-*")
+    assert conn.do_query_asn
+    assert AsnCache(cache.path).get("12345678") is None
+
+
+async def test_asn_cache_instances_keep_each_others_entries(tmp_path):
+    path = str(tmp_path / "asn.json")
+    first = AsnCache(path)
+    second = AsnCache(path)
+    first.get("1")
+    second.get("2")
+    first.set("1", "s18.myenergi.net")
+    second.set("2", "s19.myenergi.net")
+    first.invalidate("1")
+    second.set("3", "s20.myenergi.net")
+    assert AsnCache(path)._read() == {
+        "2": "s19.myenergi.net",
+        "3": "s20.myenergi.net",
+    }
+
+
+async def test_concurrent_sends_share_director_lookup():
+    calls = []
+    conn = Connection(
+        "12345678", "password", asyncClient=mock_client(director_handler(calls))
+    )
+    await asyncio.gather(*[conn.get(f"/cgi-jstatus-Z{i}") for i in range(5)])
+    assert calls.count("director.myenergi.net") == 1
+    assert calls.count("s18.myenergi.net") == 5
+    assert conn._asn_lookup is None
+
+
+async def test_identical_concurrent_gets_coalesced():
+    calls = []
+    conn = Connection(
+        "12345678", "password", asyncClient=mock_client(director_handler(calls))
+    )
+    results = await asyncio.gather(
+        *[conn.get("/cgi-jstatus-*") for _ in range(3)],
+        conn.get("/cgi-jstatus-Z12345678"),
+    )
+    assert calls.count("s18.myenergi.net") == 2
+    assert results[0] is results[1] is results[2]
+    assert conn._inflight == {}
+    await conn.get("/cgi-jstatus-*")
+    assert calls.count("s18.myenergi.net") == 3
+
+
+async def test_coalescing_can_be_disabled():
+    calls = []
+    conn = Connection(
+        "12345678",
+        "password",
+        asyncClient=mock_client(director_handler(calls)),
+        coalesce_requests=False,
+    )
+    await asyncio.gather(*[conn.get("/cgi-jstatus-*") for _ in range(3)])
+    assert calls.count("s18.myenergi.net") == 3
+
+
+async def test_phase_timeouts():
+    conn = Connection("12345678", "password", timeout=20, connect_timeout=2)
+    assert conn.timeout.connect == 2
+    assert conn.timeout.read == 20
+    await conn.close()
+
+
+@pytest.mark.parametrize(
+    "error,code",
+    [
+        (httpx.ConnectTimeout, "CONNECT_TIMEOUT"),
+        (httpx.WriteTimeout, "WRITE_TIMEOUT"),
+        (httpx.PoolTimeout, "POOL_TIMEOUT"),
+    ],
+)
+async def test_timeouts_translated(error, code):
+    def handler(request):
+        if request.url.host == "director.myenergi.net":
+            return httpx.Response(200, headers={"X_MYENERGI-asn": "s18.myenergi.net"})
+        raise error("timed out", request=request)
+
+    conn = Connection("12345678", "password", asyncClient=mock_client(handler))
+    with pytest.raises(TimeoutException) as raised:
+        await conn.get("/cgi-jstatus-*")
+    assert raised.value.code == code
+
+
+async def test_deadline_bounds_refresh():
+    server = FakeMyenergiServer.from_fixtures("tests/fixtures", latency=0.05)
+    conn = Connection("12345678", "password", asyncClient=server.client())
+    client = MyenergiClient(conn)
+    started = time.monotonic()
+    with pytest.raises(TimeoutException) as raised:
+        await client.refresh(deadline=0.12)
+    assert raised.value.code == "DEADLINE_EXCEEDED"
+    assert time.monotonic() - started < 0.2
+
+    with request_deadline(10):
+        await client.refresh()
+    assert len(client.devices) == 6
+
+
+async def test_deadline_bounds_joined_request():
+    server = FakeMyenergiServer.from_fixtures("tests/fixtures")
+    conn = Connection("12345678", "password", asyncClient=server.client())
+    await conn.get("/cgi-jstatus-*")
+    server.latency = 0.3
+    unbounded = asyncio.ensure_future(conn.get("/cgi-jstatus-*"))
+    await asyncio.sleep(0)
+    started = time.monotonic()
+    with pytest.raises(TimeoutException) as raised:
+        with request_deadline(0.05):
+            await conn.get("/cgi-jstatus-*")
+    assert raised.value.code == "DEADLINE_EXCEEDED"
+    assert time.monotonic() - started < 0.2
+    # The request started without a deadline carries on
+    assert len(await unbounded) == 5
+    assert server.count("/cgi-jstatus-*") == 3
+
+    # A request nobody waits for any more is cancelled
+    with pytest.raises(TimeoutException):
+        with request_deadline(0.05):
+            await conn.get("/cgi-jstatus-*")
+    assert conn._inflight == {}
@@ -0,0 +1,48 @@
+import json
+
+import httpx
+import pytest
+
+from pymyenergi.connection import Connection
+from pymyenergi.decoder import DECODERS
+from pymyenergi.decoder import get_decoder
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.mark.parametrize("name", list(DECODERS))
+async def test_decoders_match_stdlib(name):
+    with open("tests/fixtures/jday.json", "rb") as fixture:
+        content = fixture.read()
+    assert get_decoder(name)(content) == json.loads(content)
+
+
+async def test_get_decoder():
+    assert get_decoder("json") is json.loads
+    assert get_decoder(len) is len
+    assert get_decoder() is next(iter(DECODERS.values()))
+    with pytest.raises(ValueError):
+        get_decoder("yaml")
+
+
+async def test_connection_uses_decoder():
+    decoded = []
+
+    def decoder(content):
+        decoded.append(content)
+        return json.loads(content)
+
+    conn = Connection(
+        "12345678",
+        "password",
+        asyncClient=httpx.AsyncClient(
+            transport=httpx.MockTransport(
+                lambda request: httpx.Response(
+                    200, json={"asn": 1}, headers={"X_MYENERGI-asn": "s18.myenergi.net"}
+                )
+            )
+        ),
+        json_decoder=decoder,
+    )
+    assert await conn.get("/cgi-jstatus-*") == {"asn": 1}
+    assert decoded == [b'{"asn":1}']
@@ -0,0 +1,71 @@
+import pytest
+
+from pymyenergi.client import MyenergiClient
+from pymyenergi.connection import Connection
+from pymyenergi.exceptions import MyenergiException
+from pymyenergi.exceptions import WrongCredentials
+from pymyenergi.retry import RetryPolicy
+from pymyenergi.testing import FakeMyenergiServer
+
+pytestmark = pytest.mark.asyncio
+
+
+def fake_server(**kwargs):
+    return FakeMyenergiServer.from_fixtures(
+        "tests/fixtures", username="12345678", password="password", **kwargs
+    )
+
+
+async def test_client_end_to_end():
+    server = fake_server()
+    async with Connection("12345678", "password", asyncClient=server.client()) as conn:
+        client = MyenergiClient(conn)
+        devices = await client.get_devices()
+        assert len(devices) == 6
+        assert client.site_name == "Test Site"
+        await client.refresh_history_today()
+        assert client.energy_imported > 0
+        zappi = client.get_devices_sync("zappi")[0]
+        await zappi.set_charge_mode("Eco")
+    assert server.count("/cgi-jdayhour-") == 4
+    assert server.count("/cgi-zappi-mode-") == 1
+    # One digest challenge per host, every later request is pre-authenticated
+    assert server.count("/cgi-jstatus-E", "director.myenergi.net") == 2
+    assert server.count("/cgi-get-app-key-") == 2
+    assert server.count("/cgi-jstatus-*") == 1
+
+
+async def test_wrong_password_rejected():
+    server = fake_server()
+    conn = Connection("12345678", "wrong", asyncClient=server.client())
+    with pytest.raises(WrongCredentials):
+        await conn.get("/cgi-jstatus-*")
+
+
+async def test_injected_failures():
+    server = fake_server()
+    conn = Connection(
+        "12345678",
+        "password",
+        asyncClient=server.client(),
+        retry_policy=RetryPolicy(backoff_base=0.001),
+    )
+    await conn.get("/cgi-jstatus-*")
+    server.fail_next(429, retry_after=0)
+    server.fail_next(503)
+    assert len(await conn.get("/cgi-jstatus-*")) == 5
+
+    # Failed requests also fail the director lookups that follow them
+    server.fail_next(503, count=10)
+    with pytest.raises(MyenergiException):
+        await conn.get("/cgi-jstatus-*")
+
+
+async def test_rate_limit():
+    server = fake_server(rate_limit=2)
+    conn = Connection("12345678", "password", asyncClient=server.client())
+    with pytest.raises(MyenergiException) as error:
+        for i in range(5):
+            await conn.get(f"/cgi-jstatus-Z{i}")
+    assert error.value.code == 429
+    assert error.value.retry_after == 1
@@ -0,0 +1,149 @@
+import asyncio
+import re
+
+import httpx
+import pytest
+
+from pymyenergi.asn_cache import AsnCache
+from pymyenergi.fleet import Fleet
+
+from .conftest import load_fixture_json
+
+pytestmark = pytest.mark.asyncio
+
+FIXTURE = load_fixture_json("client")
+CHALLENGE = {"WWW-Authenticate": 'Digest realm="MEHUB", nonce="abc", qop="auth"'}
+ASN_HEADERS = {"X_MYENERGI-asn": "s18.myenergi.net"}
+
+
+class FleetServer:
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.active = 0
+        self.max_active = 0
+
+    async def __call__(self, request):
+        authorization = request.headers.get("Authorization")
+        if authorization is None:
+            return httpx.Response(401, headers=CHALLENGE)
+        serial = re.search(r'username="(\d+)"', authorization).group(1)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        if serial in self.failing:
+            return httpx.Response(503, headers=ASN_HEADERS)
+        if request.url.path == "/cgi-get-app-key-":
+            return httpx.Response(200, json=FIXTURE["keys"], headers=ASN_HEADERS)
+        return httpx.Response(200, json=FIXTURE["devices"], headers=ASN_HEADERS)
+
+
+def fleet_for(server, **kwargs):
+    return Fleet(
+        asyncClient=httpx.AsyncClient(transport=httpx.MockTransport(server)),
+        **kwargs,
+    )
+
+
+async def test_refresh_all_yields_every_hub():
+    server = FleetServer(failing=("10000003",))
+    fleet = fleet_for(server)
+    for serial in range(10000000, 10000010):
+        fleet.add_hub(str(serial), "password")
+    results = {serial: error async for serial, client, error in fleet.refresh_all()}
+    assert len(results) == 10
+    assert results["10000003"] is not None
+    assert all(error is None for s, error in results.items() if s != "10000003")
+    assert len(fleet.clients["10000000"].devices) == 6
+    await fleet.close()
+
+
+async def test_refresh_all_respects_concurrency_cap():
+    server = FleetServer()
+    fleet = fleet_for(server, max_concurrency=3)
+    for serial in range(10000000, 10000012):
+        fleet.add_hub(str(serial), "password")
+    async for _ in fleet.refresh_all():
+        pass
+    assert server.max_active <= 3
+    await fleet.close()
+
+
+async def test_connections_share_client():
+    async with Fleet() as fleet:
+        hub_1 = fleet.add_hub("10000001", "password")
+        hub_2 = fleet.add_hub("10000002", "password")
+        assert hub_1._connection.asyncClient is hub_2._connection.asyncClient
+        await fleet.remove_hub("10000001")
+        assert len(fleet) == 1
+    assert fleet.asyncClient.is_closed
+
+
+class HostServer:
+    """Hubs spread over several active servers, tracking concurrency per host"""
+
+    def __init__(self, hosts):
+        self.hosts = hosts
+        self.active = {}
+        self.max_active = {}
+        self.max_on_servers = 0
+
+    async def __call__(self, request):
+        authorization = request.headers.get("Authorization")
+        if authorization is None:
+            return httpx.Response(401, headers=CHALLENGE)
+        serial = re.search(r'username="(\d+)"', authorization).group(1)
+        host = request.url.host
+        self.active[host] = self.active.get(host, 0) + 1
+        self.max_active[host] = max(self.max_active.get(host, 0), self.active[host])
+        on_servers = sum(n for h, n in self.active.items() if not h.startswith("dir"))
+        self.max_on_servers = max(self.max_on_servers, on_servers)
+        await asyncio.sleep(0.01)
+        self.active[host] -= 1
+        headers = {"X_MYENERGI-asn": self.hosts[serial]}
+        if request.url.path == "/cgi-get-app-key-":
+            return httpx.Response(200, json=FIXTURE["keys"], headers=headers)
+        return httpx.Response(200, json=FIXTURE["devices"], headers=headers)
+
+
+async def test_busy_host_does_not_starve_others():
+    hosts = {str(10000000 + i): "s18.myenergi.net" for i in range(30)}
+    hosts.update({str(20000000 + i): f"s{i}.myenergi.net" for i in range(8)})
+    server = HostServer(hosts)
+    fleet = fleet_for(server, max_concurrency=10, per_host_limit=2)
+    for serial in hosts:
+        fleet.add_hub(serial, "password")
+    async for _ in fleet.refresh_all():
+        pass
+    order = [serial async for serial, client, error in fleet.refresh_all()]
+    # Hubs on the other servers are not queued behind the busy one
+    others = {serial for serial in hosts if serial.startswith("2")}
+    assert others <= set(order[:10])
+    assert server.max_active["s18.myenergi.net"] <= 2
+    await fleet.close()
+
+
+async def test_cold_fleet_only_limits_director_lookups():
+    hosts = {str(10000000 + i): f"s{i % 4}.myenergi.net" for i in range(16)}
+    server = HostServer(hosts)
+    fleet = fleet_for(server, max_concurrency=16, per_host_limit=2)
+    for serial in hosts:
+        fleet.add_hub(serial, "password")
+    results = [error async for serial, client, error in fleet.refresh_all()]
+    assert results == [None] * 16
+    assert server.max_active["director.myenergi.net"] <= 2
+    # Once the active servers are known, 2 hubs per server run at once
+    assert server.max_on_servers > 2
+    await fleet.close()
+
+
+async def test_hubs_share_asn_cache(tmp_path):
+    path = str(tmp_path / "asn.json")
+    fleet = fleet_for(FleetServer(), asn_cache=path)
+    first = fleet.add_hub("10000001", "password")
+    second = fleet.add_hub("10000002", "password")
+    assert first._connection.asn_cache is second._connection.asn_cache
+    async for _ in fleet.refresh_all():
+        pass
+    assert set(AsnCache(path)._read()) == {"10000001", "10000002"}
+    await fleet.close()
@@ -0,0 +1,121 @@
+import random
+from datetime import datetime
+from datetime import timezone
+
+import pytest
+
+from pymyenergi import HOUR
+from pymyenergi import MINUTE
+from pymyenergi.client import MyenergiClient
+from pymyenergi.connection import Connection
+from pymyenergi.history import COLUMNS
+from pymyenergi.history import ENERGY_KEYS
+from pymyenergi.history import HistorySeries
+from pymyenergi.history import sum_energy
+from pymyenergi.history import sum_energy_columns
+from pymyenergi.history import to_columns
+from pymyenergi.testing import FakeMyenergiServer
+
+from .conftest import load_fixture_json
+
+pytestmark = pytest.mark.asyncio
+
+MINUTE_ROWS = next(iter(load_fixture_json("jday").values()))
+
+
+def reference_energy_wh(rows):
+    """Row by row sums as computed before the columnar path"""
+    energy_wh = dict.fromkeys(ENERGY_KEYS, 0)
+    for row in rows:
+        for key in energy_wh:
+            if key.startswith("ct"):
+                watt_hours = (
+                    row.get(f"pe{key}", 0) / 3600 - row.get(f"ne{key}", 0) / 3600
+                )
+            else:
+                watt_hours = row.get(key, 0) / 3600
+            energy_wh[key] = energy_wh[key] + watt_hours
+    return energy_wh
+
+
+def day_of_rows(seed):
+    rng = random.Random(seed)
+    rows = []
+    for minute in range(1440):
+        row = {"hr": minute // 60, "min": minute % 60, "v1": 2378}
+        for key in COLUMNS:
+            if rng.random() < 0.5:
+                row[key] = rng.randint(0, 60000)
+        rows.append(row)
+    return rows
+
+
+def assert_energy_equal(energy, expected):
+    assert set(energy) == set(ENERGY_KEYS)
+    for key in ENERGY_KEYS:
+        assert energy[key] == pytest.approx(expected[key], abs=1e-6)
+
+
+async def test_sum_energy_matches_row_by_row():
+    for rows in (MINUTE_ROWS, day_of_rows(1), []):
+        assert_energy_equal(sum_energy(rows), reference_energy_wh(rows))
+
+
+async def test_sum_energy_columns_lists():
+    rows = day_of_rows(2)
+    columns = to_columns(rows, use_numpy=False)
+    assert isinstance(columns["imp"], list)
+    assert_energy_equal(sum_energy_columns(columns), reference_energy_wh(rows))
+
+
+async def test_sum_energy_columns_numpy():
+    numpy = pytest.importorskip("numpy")
+    days = [day_of_rows(seed) for seed in range(3)]
+    columns = to_columns(days[0], use_numpy=True)
+    assert columns["imp"].dtype == numpy.float64
+    assert_energy_equal(sum_energy_columns(columns), reference_energy_wh(days[0]))
+
+    # Several days stacked are reduced at once
+    stacked = {
+        key: numpy.stack([to_columns(day)[key] for day in days]) for key in COLUMNS
+    }
+    assert_energy_equal(
+        sum_energy_columns(stacked), reference_energy_wh([r for d in days for r in d])
+    )
+
+
+async def test_history_series_from_rows():
+    start = int(datetime(2021, 9, 4, 23, tzinfo=timezone.utc).timestamp())
+    series = HistorySeries.from_rows(MINUTE_ROWS, start, 1440, MINUTE, 60, False)
+    assert len(series) == 1440
+    assert series.timestamp[:2] == [start, start + 60]
+    assert series["nect1"][0] == MINUTE_ROWS[0]["nect1"]
+    assert series.pect2[1] == MINUTE_ROWS[1]["pect2"]
+    # Minutes without a row are 0
+    assert series.imp[-1] == 0
+    assert_energy_equal(series.energy_wh(), reference_energy_wh(MINUTE_ROWS))
+    with pytest.raises(KeyError):
+        series["v1"]
+
+    # Rows outside the period are left out
+    short = HistorySeries.from_rows(MINUTE_ROWS, start + 60, 2, MINUTE, 60, False)
+    assert short.nect1 == [MINUTE_ROWS[1]["nect1"], MINUTE_ROWS[2]["nect1"]]
+
+
+async def test_device_history_series():
+    server = FakeMyenergiServer.from_fixtures("tests/fixtures")
+    async with Connection("12345678", "password", asyncClient=server.client()) as conn:
+        client = MyenergiClient(conn)
+        zappi = (await client.get_devices("zappi"))[0]
+        date_from = datetime(2021, 9, 4, 23, 30, tzinfo=timezone.utc)
+        series = await zappi.history_series(date_from, 1440)
+        hours = await zappi.history_series(date_from, 24, HOUR)
+    assert len(series) == 1440
+    assert (
+        series.timestamp[0] == datetime(2021, 9, 4, 23, tzinfo=timezone.utc).timestamp()
+    )
+    assert_energy_equal(series.energy_wh(), reference_energy_wh(MINUTE_ROWS))
+    assert hours.resolution == HOUR
+    assert hours.timestamp[1] - hours.timestamp[0] == 3600
+    numpy = pytest.importorskip("numpy")
+    assert isinstance(series.imp, numpy.ndarray)
@@ -0,0 +1,67 @@
+import httpx
+import pytest
+
+from pymyenergi.connection import Connection
+from pymyenergi.exceptions import MyenergiException
+from pymyenergi.metrics import RequestMetrics
+from pymyenergi.metrics import endpoint_name
+
+pytestmark = pytest.mark.asyncio
+
+ASN_HEADERS = {"X_MYENERGI-asn": "s18.myenergi.net"}
+
+
+def handler(request):
+    if request.url.path.startswith("/cgi-jday-"):
+        return httpx.Response(503, headers=ASN_HEADERS)
+    return httpx.Response(200, json={"data": [1, 2, 3]}, headers=ASN_HEADERS)
+
+
+def traced_connection(**kwargs):
+    return Connection(
+        "12345678",
+        "password",
+        asyncClient=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        **kwargs,
+    )
+
+
+async def test_endpoint_name():
+    assert endpoint_name("/cgi-jstatus-*") == "cgi-jstatus"
+    assert endpoint_name("/cgi-jstatus-Z12345678") == "cgi-jstatus"
+    assert endpoint_name("/cgi-get-app-key-") == "cgi-get-app-key"
+    assert endpoint_name("/cgi-jday-Z12345678-2023-1-1-0-0-1440") == "cgi-jday"
+    assert endpoint_name("/cgi-zappi-mode-Z12345678-1-0-0-0000") == "cgi-zappi-mode"
+    assert (
+        endpoint_name("/api/AccountAccess/12345678/LibbiChargeSetup?x=1")
+        == "api/AccountAccess/{serial}/LibbiChargeSetup"
+    )
+
+
+async def test_hooks_called():
+    conn = traced_connection()
+    started = []
+    ended = []
+    conn.on_request_start(lambda trace: started.append(trace.endpoint))
+    conn.on_request_end(ended.append)
+    await conn.get("/cgi-jstatus-*")
+    assert started == ["cgi-jstatus", "cgi-jstatus"]
+    assert [trace.auth for trace in ended] == ["director", "digest"]
+    assert ended[1].status_code == 200
+    assert ended[1].bytes == len(b'{"data":[1,2,3]}')
+    assert ended[1].elapsed >= 0
+
+
+async def test_metrics_collected():
+    metrics = RequestMetrics()
+    conn = traced_connection(metrics=metrics)
+    for _ in range(3):
+        await conn.get("/cgi-jstatus-Z12345678")
+    with pytest.raises(MyenergiException):
+        await conn.get("/cgi-jday-Z12345678-2023-1-1-0-0-1440")
+    snapshot = metrics.snapshot()
+    assert snapshot[("cgi-jstatus", "director", 200)]["count"] == 1
+    stats = snapshot[("cgi-jstatus", "digest", 200)]
+    assert stats["count"] == 3
+    assert stats["p50"] is not None and stats["p99"] >= stats["p50"]
+    assert snapshot[("cgi-jday", "digest", 503)]["count"] == 1
@@ -0,0 +1,146 @@
+import asyncio
+import base64
+import json
+import time
+
+import httpx
+import pytest
+
+from pymyenergi.connection import Connection
+from pymyenergi.oauth import TokenManager
+from pymyenergi.oauth import token_expiry
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_token(expires_in, serial=0):
+    payload = json.dumps({"exp": int(time.time() + expires_in), "n": serial})
+    encoded = base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+    return f"header.{encoded}.signature"
+
+
+class FakeCognito:
+    def __init__(self, expires_in=3600):
+        self.expires_in = expires_in
+        self.access_token = None
+        self.refresh_token = None
+        self.authenticate_calls = 0
+        self.renew_calls = 0
+
+    def authenticate(self, password):
+        time.sleep(0.01)
+        self.authenticate_calls += 1
+        self.access_token = make_token(self.expires_in, self.authenticate_calls)
+        self.refresh_token = "refresh"
+
+    def renew_access_token(self):
+        self.renew_calls += 1
+        self.access_token = make_token(3600, 100 + self.renew_calls)
+
+
+def oauth_connection(handler, cognito):
+    conn = Connection(
+        "12345678",
+        "password",
+        "app-password",
+        "app@email.com",
+        asyncClient=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    conn.token_manager = TokenManager("app@email.com", "app-password", cognito=cognito)
+    conn.oauth = cognito
+    return conn
+
+
+async def test_token_expiry():
+    token = make_token(60)
+    assert abs(token_expiry(token) - (time.time() + 60)) < 2
+    assert token_expiry("not-a-jwt") is None
+
+
+async def test_concurrent_requests_share_authentication():
+    cognito = FakeCognito()
+    conn = oauth_connection(lambda request: httpx.Response(200, json={}), cognito)
+    await asyncio.gather(*[conn.get("/api/Location", oauth=True) for _ in range(5)])
+    assert cognito.authenticate_calls == 1
+    await conn.close()
+
+
+async def test_token_renewed_before_expiry():
+    cognito = FakeCognito(expires_in=60)
+    conn = oauth_connection(lambda request: httpx.Response(200, json={}), cognito)
+    await conn.get("/api/Location", oauth=True)
+    # Token expires within the refresh margin, so the background task renews it
+    await asyncio.sleep(0.01)
+    assert cognito.renew_calls == 1
+    await conn.get("/api/Location", oauth=True)
+    assert cognito.authenticate_calls == 1
+    assert cognito.renew_calls == 1
+    await conn.close()
+
+
+async def test_rejected_token_renewed_and_retried():
+    cognito = FakeCognito()
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers["Authorization"])
+        if len(seen) == 1:
+            return httpx.Response(401)
+        return httpx.Response(200, json={"content": []})
+
+    conn = oauth_connection(handler, cognito)
+    assert await conn.get("/api/Location", oauth=True) == {"content": []}
+    assert cognito.renew_calls == 1
+    assert seen[0] != seen[1]
+    await conn.close()
+
+
+class FailingCognito(FakeCognito):
+    """Logs in once, then every renewal and authentication fails"""
+
+    def authenticate(self, password):
+        if self.authenticate_calls:
+            self.authenticate_calls += 1
+            raise Exception("Cognito unavailable")
+        super().authenticate(password)
+
+    def renew_access_token(self):
+        self.renew_calls += 1
+        raise Exception("Cognito unavailable")
+
+
+async def test_failed_renewal_keeps_valid_token():
+    cognito = FailingCognito(expires_in=60)
+    manager = TokenManager(
+        "app@email.com", "app-password", cognito=cognito, retry_delay=0.05
+    )
+    headers = await manager.headers()
+    # The token is within the refresh margin, so renewal starts right away
+    await asyncio.sleep(0.02)
+    assert cognito.renew_calls == 1
+    assert cognito.authenticate_calls == 2
+    # The token is still valid, so requests keep using it without renewing
+    assert await manager.headers() == headers
+    assert cognito.renew_calls == 1
+    # The renewal is retried in the background with a growing delay
+    await asyncio.sleep(0.3)
+    assert 2 <= cognito.renew_calls <= 4
+    assert manager._refresh_task is not None
+    # Once the token has expired the error surfaces
+    cognito.access_token = make_token(-10)
+    with pytest.raises(Exception):
+        await manager.headers()
+    await manager.close()
+
+
+async def test_close_cancels_update_in_flight():
+    cognito = FakeCognito()
+    manager = TokenManager("app@email.com", "app-password", cognito=cognito)
+    update = asyncio.ensure_future(manager.update())
+    await asyncio.sleep(0)
+    pending = manager._pending
+    await manager.close()
+    assert pending.done()
+    assert manager._pending is None
+    update.cancel()
+    await asyncio.gather(update, return_exceptions=True)
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from pymyenergi.client import MyenergiClient
+from pymyenergi.connection import Connection
+from pymyenergi.testing import FakeMyenergiServer
+
+pytestmark = pytest.mark.asyncio
+
+
+def site():
+    server = FakeMyenergiServer.from_fixtures("tests/fixtures")
+    conn = Connection("12345678", "password", asyncClient=server.client())
+    return server, MyenergiClient(conn)
+
+
+def set_status(server, kind, status):
+    for group in server.devices:
+        for device in group.get(kind, []):
+            device["sta"] = status
+
+
+async def test_interval_follows_device_state():
+    server, client = site()
+    set_status(server, "libbi", 4)
+    poller = client.start_polling(fast_interval=0.01, slow_interval=10)
+    await asyncio.sleep(0.05)
+    assert poller.interval() == 10
+    assert server.count("/cgi-jstatus-*") == 1
+
+    set_status(server, "zappi", 3)
+    await client.refresh()
+    assert client.get_devices_sync("zappi")[0].is_active
+    assert poller.interval() == 0.01
+    await client.stop_polling()
+    assert not client.is_polling
+
+
+async def test_polls_fast_while_charging():
+    server, client = site()
+    set_status(server, "zappi", 4)
+    client.start_polling(fast_interval=0.01, slow_interval=10, history_interval=10)
+    assert client.is_polling
+    with pytest.raises(RuntimeError):
+        client.start_polling()
+    await asyncio.sleep(0.1)
+    await client.stop_polling()
+    assert server.count("/cgi-jstatus-*") > 3
+    # History has its own cadence
+    assert server.count("/cgi-jdayhour-") == 4
+    assert client.energy_imported > 0
+
+
+async def test_polling_survives_errors():
+    server, client = site()
+    server.fail_next(503, count=3)
+    poller = client.start_polling(
+        fast_interval=0.01, slow_interval=0.01, history_interval=None
+    )
+    await asyncio.sleep(0.1)
+    await client.stop_polling()
+    assert poller.last_error is not None
+    assert len(client.devices) == 6
@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from pymyenergi.connection import Connection
+from pymyenergi.ratelimit import RateLimiter
+from pymyenergi.ratelimit import TokenBucket
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_bucket_allows_burst_then_waits():
+    bucket = TokenBucket(rate=50, burst=3)
+    start = time.monotonic()
+    for _ in range(3):
+        await bucket.acquire()
+    assert time.monotonic() - start < 0.01
+    for _ in range(2):
+        await bucket.acquire()
+    assert time.monotonic() - start >= 0.035
+
+
+async def test_limiter_keyed_per_hub_and_host():
+    limiter = RateLimiter(
+        rate=1, burst=1, host_rates={"myaccount.myenergi.com": (10, 5)}
+    )
+    assert limiter.bucket("1", "s18.myenergi.net") is limiter.bucket(
+        "1", "s18.myenergi.net"
+    )
+    assert limiter.bucket("1", "s18.myenergi.net") is not limiter.bucket(
+        "2", "s18.myenergi.net"
+    )
+    assert limiter.bucket("1", "myaccount.myenergi.com").burst == 5
+
+
+async def test_connection_requests_queue_on_limit():
+    sent = []
+
+    def handler(request):
+        sent.append(time.monotonic())
+        return httpx.Response(
+            200, json={}, headers={"X_MYENERGI-asn": "s18.myenergi.net"}
+        )
+
+    conn = Connection(
+        "12345678",
+        "password",
+        asyncClient=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        rate_limiter=RateLimiter(rate=50, burst=2),
+    )
+    await conn.get("/cgi-jstatus-*")
+    await asyncio.gather(*[conn.get(f"/cgi-jstatus-Z{i}") for i in range(3)])
+    # Director has its own bucket, the ASN host allows two at once then 50/s
+    assert len(sent) == 5
+    assert sent[-1] - sent[1] >= 0.035
@@ -0,0 +1,132 @@
+import httpx
+import pytest
+
+from pymyenergi.connection import Connection
+from pymyenergi.exceptions import MyenergiException
+from pymyenergi.exceptions import TimeoutException
+from pymyenergi.exceptions import WrongCredentials
+from pymyenergi.retry import RetryPolicy
+from pymyenergi.retry import parse_retry_after
+
+pytestmark = pytest.mark.asyncio
+
+ASN_HEADERS = {"X_MYENERGI-asn": "s18.myenergi.net"}
+
+
+def flaky_connection(statuses, retry_policy, headers=None):
+    """Connection whose server answers with the given statuses, then 200"""
+    requests = []
+
+    def handler(request):
+        if request.url.host == "director.myenergi.net":
+            return httpx.Response(200, headers=ASN_HEADERS)
+        requests.append(request.url.path)
+        if len(requests) <= len(statuses):
+            return httpx.Response(
+                statuses[len(requests) - 1], headers={**ASN_HEADERS, **(headers or {})}
+            )
+        return httpx.Response(200, json={"ok": True}, headers=ASN_HEADERS)
+
+    conn = Connection(
+        "12345678",
+        "password",
+        asyncClient=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        retry_policy=retry_policy,
+    )
+    return conn, requests
+
+
+async def test_parse_retry_after():
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert parse_retry_after("soon") is None
+
+
+async def test_classification():
+    policy = RetryPolicy()
+    status_url = "/cgi-jstatus-*"
+    mode_url = "/cgi-zappi-mode-Z12345678-1-0-0-0000"
+    assert policy.is_retryable(MyenergiException(503), "GET", status_url)
+    assert policy.is_retryable(TimeoutException(), "GET", status_url)
+    assert not policy.is_retryable(MyenergiException(404), "GET", status_url)
+    assert not policy.is_retryable(WrongCredentials(), "GET", status_url)
+    assert not policy.is_retryable(MyenergiException(503), "GET", mode_url)
+    assert not policy.is_retryable(TimeoutException(), "GET", mode_url)
+    assert policy.is_retryable(MyenergiException(429), "GET", mode_url)
+    assert policy.is_retryable(MyenergiException(503), "GET", "/api/Location", True)
+    read_error = httpx.ReadError("Connection reset")
+    assert policy.is_retryable(read_error, "GET", status_url)
+    assert not policy.is_retryable(read_error, "GET", mode_url)
+
+
+async def test_backoff_grows_and_honours_retry_after():
+    policy = RetryPolicy(backoff_base=1, backoff_max=4)
+    for attempt in range(1, 6):
+        assert 0 <= policy.backoff(attempt) <= min(4, 2 ** (attempt - 1))
+    error = MyenergiException(429)
+    error.retry_after = 2
+    assert 2 <= policy.backoff(1, error) <= 3
+    error.retry_after = 60
+    assert policy.delay(1, error, "GET", "/cgi-jstatus-*") is None
+
+
+async def test_transient_error_retried():
+    conn, requests = flaky_connection([503, 503], RetryPolicy(backoff_base=0.001))
+    assert await conn.get("/cgi-jstatus-*") == {"ok": True}
+    assert len(requests) == 3
+
+
+async def test_read_error_retried_on_read_endpoint():
+    requests = []
+
+    def handler(request):
+        if request.url.host == "director.myenergi.net":
+            return httpx.Response(200, headers=ASN_HEADERS)
+        requests.append(request.url.path)
+        if len(requests) != 2:
+            raise httpx.ReadError("Connection reset", request=request)
+        return httpx.Response(200, json={"ok": True}, headers=ASN_HEADERS)
+
+    conn = Connection(
+        "12345678",
+        "password",
+        asyncClient=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        retry_policy=RetryPolicy(backoff_base=0.001),
+    )
+    assert await conn.get("/cgi-jstatus-*") == {"ok": True}
+    assert len(requests) == 2
+    with pytest.raises(httpx.ReadError):
+        await conn.get("/cgi-zappi-mode-Z12345678-1-0-0-0000")
+    assert len(requests) == 3
+
+
+async def test_gives_up_after_max_attempts():
+    conn, requests = flaky_connection(
+        [503, 503, 503], RetryPolicy(max_attempts=3, backoff_base=0.001)
+    )
+    with pytest.raises(MyenergiException):
+        await conn.get("/cgi-jstatus-*")
+    assert len(requests) == 3
+
+
+async def test_control_command_not_repeated():
+    conn, requests = flaky_connection([503], RetryPolicy(backoff_base=0.001))
+    with pytest.raises(MyenergiException):
+        await conn.get("/cgi-zappi-mode-Z12345678-1-0-0-0000")
+    assert len(requests) == 1
+
+
+async def test_control_command_retried_after_429():
+    conn, requests = flaky_connection(
+        [429], RetryPolicy(backoff_base=0.001), headers={"Retry-After": "0"}
+    )
+    await conn.get("/cgi-zappi-mode-Z12345678-1-0-0-0000")
+    assert len(requests) == 2
+
+
+async def test_no_retries_by_default():
+    conn, requests = flaky_connection([503], None)
+    with pytest.raises(MyenergiException):
+        await conn.get("/cgi-jstatus-*")
+    assert len(requests) == 1
@@ -0,0 +1,61 @@
+import pytest
+
+from pymyenergi.client import MyenergiClient
+from pymyenergi.connection import Connection
+from pymyenergi.testing import FakeMyenergiServer
+
+pytestmark = pytest.mark.asyncio
+
+
+def fake_server():
+    return FakeMyenergiServer.from_fixtures(
+        "tests/fixtures", username="12345678", password="password"
+    )
+
+
+async def test_save_and_restore(tmp_path):
+    path = tmp_path / "snapshot.json"
+    async with Connection(
+        "12345678", "password", asyncClient=fake_server().client()
+    ) as conn:
+        client = MyenergiClient(conn)
+        await client.refresh()
+        await client.refresh_history_today()
+        client.save_snapshot(path)
+
+    server = fake_server()
+    conn = Connection("12345678", "password", asyncClient=server.client())
+    restored = MyenergiClient.from_snapshot(conn, path)
+    assert server.requests == []
+    assert restored.snapshot_time is not None
+    assert restored.site_name == client.site_name
+    assert restored.firmware_version == client.firmware_version
+    assert restored.get_power_totals() == client.get_power_totals()
+    assert restored.energy_imported == client.energy_imported
+    assert [d.name for d in restored.get_devices_sync()] == [
+        d.name for d in client.get_devices_sync()
+    ]
+    zappi = restored.get_devices_sync("zappi")[0]
+    assert zappi.history_data == client.get_devices_sync("zappi")[0].history_data
+
+    # The keys and the active server come from the snapshot
+    await restored.refresh()
+    assert server.count("/cgi-get-app-key-") == 0
+    assert server.count("/cgi-jstatus-E", "director.myenergi.net") == 0
+    assert server.count("/cgi-jstatus-*", "s18.myenergi.net") == 2
+    await conn.close()
+
+
+async def test_snapshot_for_other_hub(tmp_path):
+    path = tmp_path / "snapshot.json"
+    async with Connection(
+        "12345678", "password", asyncClient=fake_server().client()
+    ) as conn:
+        client = MyenergiClient(conn)
+        await client.refresh()
+        client.save_snapshot(path)
+    with pytest.raises(ValueError):
+        MyenergiClient.from_snapshot(Connection("87654321", "password"), path)
+    path.write_text("{}")
+    with pytest.raises(ValueError):
+        MyenergiClient.from_snapshot(Connection("12345678", "password"), path)